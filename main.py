@@ -7,12 +7,14 @@ from typing import Optional
 
 import dis_snek.api.events
 from beanie import init_beanie
-from dis_snek import AllowedMentions, InteractionContext, Snake, errors, listen
+from dis_snek import AllowedMentions, InteractionContext, SlashCommand, Snake, errors, listen
 from dis_snek.models import Intents
 from motor import motor_asyncio
 
 import utils.log as log_utils
 from config import load_settings
+from utils import db as db_utils
+from utils import db_monitor
 from utils import misc as utils
 
 logger: log_utils.BotLogger = logging.getLogger()  # type: ignore
@@ -36,6 +38,10 @@ class Bot(Snake):
         )
 
         self.db: Optional[motor_asyncio.AsyncIOMotorClient] = None
+        self.query_monitor = db_monitor.QueryMonitor(
+            slow_threshold=self.config.db_slow_query_ms / 1000,
+            repeat_threshold=self.config.db_repeated_query_threshold,
+        )
         self.models = list()
 
         self.emojis = dict()
@@ -57,8 +63,15 @@ class Bot(Snake):
         if self.config.debug:
             self.grow_scale("dis_snek.ext.debug_scale")
 
-        self.db = motor_asyncio.AsyncIOMotorClient(self.config.database_address)
-        await init_beanie(database=self.db.db_name, document_models=self.models)
+        if not hasattr(Snake, "_run_slash_command"):  # hook was added in dis_snek 8.0
+            logger.warning("Installed dis_snek doesn't run slash commands via _run_slash_command, they won't be profiled")
+
+        db_utils.configure_caches(self.config.get("db_cache"))
+        self.db = motor_asyncio.AsyncIOMotorClient(self.config.database_address, event_listeners=[self.query_monitor])
+        database = self.db.db_name
+        for model in self.models:
+            await model.migrate(database)
+        await init_beanie(database=database, document_models=self.models)
         await self.astart(self.config.discord_token)
 
     @listen()
@@ -77,6 +90,11 @@ class Bot(Snake):
     # async def on_message_create(self, event: dis_snek.api.events.MessageCreate):
     #     print(event.message.content)
 
+    async def _run_slash_command(self, command: SlashCommand, ctx: InteractionContext):
+        name = " ".join(filter(None, [command.name, command.group_name, command.sub_cmd_name]))
+        with self.query_monitor.profile(f"/{name}"):
+            return await super()._run_slash_command(command, ctx)
+
     async def on_command_error(self, ctx: InteractionContext, error: Exception, *args, **kwargs):
         unexpected = True
         if isinstance(error, errors.CommandCheckFailure):
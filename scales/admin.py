@@ -5,8 +5,12 @@ import dis_snek
 from beanie import init_beanie
 from dis_snek import AutocompleteContext, InteractionContext, Scale, check, slash_str_option, subcommand
 
+import utils.db as db
+import utils.misc as utils
 from scales.permissions import Permissions
-from utils.fuzz import fuzzy_autocomplete, fuzzy_find
+import utils.autocomplete as autocomplete
+import utils.fuzz as fuzz
+from utils.fuzz import fuzzy_autocomplete_async
 
 if TYPE_CHECKING:
     from main import Bot
@@ -63,11 +67,57 @@ class Admin(Scale):
         await ctx.send(msg)
 
     @reload.autocomplete("extension")
+    @autocomplete.cached_autocomplete
     async def _reload_extension(self, ctx: AutocompleteContext, extension, **kwargs):
         extensions = list(self.bot.get_extensions())
-        choices = [choice[0] for choice in fuzzy_autocomplete(extension, extensions)]
+        choices = [choice[0] for choice in await fuzzy_autocomplete_async(extension, extensions)]
         await ctx.send(choices)
 
+    @check(Permissions.check_admin)
+    @subcommand("bot", name="stats")
+    async def stats(self, ctx: InteractionContext):
+        """Shows internal performance counters"""
+        await ctx.defer(ephemeral=True)
+
+        stats = db.get_cache_stats()
+        stats.update(self.bot.query_monitor.get_stats())
+        stats.update(fuzz.get_stats())
+        stats.update(autocomplete.get_stats())
+        for scale in self.bot.scales.values():
+            if hasattr(scale, "get_stats"):
+                stats.update(scale.get_stats())
+
+        embed = utils.get_default_embed(ctx.guild, "Bot stats", utils.ResponseStatusColors.INFO)
+        for name, values in stats.items():
+            if not values:
+                continue  # e.g. no commands were profiled since the start
+            lines = utils.format_lines({key: str(value) for key, value in values.items()})
+            embed.add_field(name=name, value="```\n" + "\n".join(lines) + "\n```", inline=False)
+
+        if not embed.fields:
+            embed.description = "No stats available"
+        await ctx.send(embed=embed)
+
+    @check(Permissions.check_admin)
+    @subcommand("bot", name="index_audit")
+    async def index_audit(self, ctx: InteractionContext):
+        """Checks query plans of all hot queries and reports ones, that scan whole collections"""
+        await ctx.defer(ephemeral=True)
+
+        audits = await db.audit_query_shapes()
+        lines = []
+        for audit in audits:
+            mark = "⚠️" if audit.is_collection_scan else "✅"
+            plan = " → ".join(audit.stages)
+            indexes = f" [{', '.join(audit.indexes)}]" if audit.indexes else ""
+            lines.append(f"{mark} **{audit.model_name}** {audit.name}: `{plan}`{indexes}")
+
+        scans = sum(audit.is_collection_scan for audit in audits)
+        status = utils.ResponseStatusColors.INCORRECT_INPUT if scans else utils.ResponseStatusColors.SUCCESS
+        embed = utils.get_default_embed(ctx.guild, f"Index audit: {scans} collection scans", status)
+        embed.description = "\n".join(lines)[:4096] or "No registered queries"
+        await ctx.send(embed=embed)
+
     @subcommand("bot", name="test")
     async def test(self, ctx: InteractionContext):
         from scales.roles import RoleGroup, BotRole
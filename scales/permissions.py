@@ -1,15 +1,21 @@
+import asyncio
+
 import dis_snek
 from dis_snek import Scale, InteractionContext, AutocompleteContext
 from dis_snek import subcommand, check, is_owner, slash_str_option, slash_user_option
 
 from beanie import Indexed
+from pymongo import ASCENDING, IndexModel
+
+import utils.db as db
 from utils.db import Document
 
 from typing import Optional, Union, TYPE_CHECKING
 
 from utils import misc as utils
 from utils.misc import send_with_embed, ResponseStatusColors
-from utils.fuzz import fuzzy_autocomplete
+from utils.autocomplete import cached_autocomplete
+from utils.fuzz import fuzzy_autocomplete_async
 
 
 if TYPE_CHECKING:
@@ -30,6 +36,16 @@ class BotManagers(Document):
 
     can_grant: bool = False
 
+    class Settings(Document.Settings):
+        indexes = [
+            IndexModel([("member_id", ASCENDING), ("guild_id", ASCENDING)], name="member_guild"),
+        ]
+
+
+db.register_query_shape(BotAdmins, "by user", {"user_id": 0})
+db.register_query_shape(BotManagers, "by member", {"member_id": 0})
+db.register_query_shape(BotManagers, "by member and guild", {"member_id": 0, "guild_id": 0})
+
 
 # TODO track roles that grant manager permissions
 
@@ -42,6 +58,14 @@ async def can_manage_role(member: dis_snek.Member, role: dis_snek.Role) -> bool:
     return False
 
 
+async def can_manage_roles(member: dis_snek.Member, roles: list[dis_snek.Role]) -> dict[int, bool]:
+    """Bulk version of can_manage_role, checks member permissions only once. Returns role ID -> result"""
+    if not (member.has_permission(dis_snek.Permissions.MANAGE_ROLES) or await Permissions.is_manager(member)):
+        return {role.id: False for role in roles}
+    top_role = member.top_role
+    return {role.id: bool(top_role and top_role.position > role.position) for role in roles}
+
+
 class Permissions(Scale):
     bot: "Bot"
 
@@ -95,16 +119,18 @@ class Permissions(Scale):
         )
 
     @admin_revoke.autocomplete("user_id")
+    @cached_autocomplete
     async def _admin_revoke_user_id(self, ctx: AutocompleteContext, user_id, **kwargs):
         db_admins = await BotAdmins.all().to_list()
-        admins = [await self.fetch_user(ctx, admin.user_id) for admin in db_admins]
-        admin_tags = [user.tag for user in admins if user is not None]
-        admin_ids = [str(admin.user_id) for admin in db_admins]
-
-        # fuzzy_autocomplete()
+        admins = await asyncio.gather(*(self.fetch_user(ctx, admin.user_id) for admin in db_admins))
 
-        choices = [f"{user.id}: {user.tag}" for user in admins]
-        await ctx.send()
+        # Searching by both ID and tag, user ID is the value of the option
+        choices = {
+            str(db_admin.user_id): f"{db_admin.user_id}: {user.tag}" if user is not None else str(db_admin.user_id)
+            for db_admin, user in zip(db_admins, admins)
+        }
+        results = await fuzzy_autocomplete_async(user_id, choices)
+        await ctx.send([dict(name=name, value=admin_id) for name, _, admin_id in results])
 
     @subcommand(base="permissions", subcommand_group="admin", name="check")
     async def admin_check_cmd(
@@ -227,7 +253,7 @@ class Permissions(Scale):
 
     @classmethod
     async def is_admin(cls, user) -> bool:
-        admin = await BotAdmins.find_one(BotAdmins.user_id == user.id)
+        admin = await BotAdmins.find_one_cached(BotAdmins.user_id == user.id)
         return bool(admin)
 
     @classmethod
@@ -242,7 +268,7 @@ class Permissions(Scale):
         if await member.guild.get_owner() == member:
             return True
 
-        manager = await BotManagers.find_one(BotManagers.member_id == member.id)
+        manager = await BotManagers.find_one_cached(BotManagers.member_id == member.id)
         if not manager:
             return False
 
@@ -1,8 +1,15 @@
+import asyncio
+import functools
+import hashlib
+import itertools
 import logging
-from typing import TYPE_CHECKING, Any, List, Optional, Tuple
+import time
+from datetime import datetime
+from typing import TYPE_CHECKING, Any, List, Optional, Tuple, Union
 
+import attr
 import dis_snek
-from beanie import Indexed, Link, ValidateOnSave, before_event
+from beanie import Indexed, Insert, Link, PydanticObjectId, Replace, SaveChanges, after_event
 from beanie.operators import In, Set
 from bson.objectid import ObjectId
 from dis_snek import (
@@ -34,16 +41,20 @@ from dis_snek import (
 )
 from pydantic import Field, validator, ValidationError
 from pydantic.color import Color
+from pymongo import ASCENDING, IndexModel
+from pymongo.errors import DuplicateKeyError
 
 # from pydantic import BaseModel
 import utils.log as log_utils
 import utils.misc as utils
 import utils.modals as modals
 import utils.db as db
-from scales.permissions import Permissions, can_manage_role
+from scales.permissions import Permissions, can_manage_role, can_manage_roles
+from utils.autocomplete import cached_autocomplete
 from utils.db import Document
-from utils.fuzz import fuzzy_autocomplete, fuzzy_find
+from utils.fuzz import FuzzyIndex, get_dynamic_index
 from utils.misc import ResponseStatusColors, send_with_embed
+from utils.tasks import Debouncer, run_spread
 
 if TYPE_CHECKING:
     from main import Bot
@@ -62,16 +73,45 @@ class RoleGroup(Document):
     # Validators
     validate_name = validator("name", allow_reuse=True)(db.validate_name)
 
-    @before_event(ValidateOnSave)
-    async def validate_db(self):
-        # validate name
-        print("VALIDATION", self.name, self)
-        cls = self.__class__
-        if await cls.find_one(cls.name == self.name, cls.guild_id == self.guild_id, cls.id != self.id):
-            raise utils.BadBotArgument(f"Role group with name '{self.name}' already exists on this server!")
+    class Settings(Document.Settings):
+        indexes = [
+            # Group names are unique per server
+            IndexModel([("guild_id", ASCENDING), ("name", ASCENDING)], name="guild_id_name_unique", unique=True),
+            IndexModel([("guild_id", ASCENDING), ("priority", ASCENDING)], name="guild_id_priority"),
+        ]
+
+    def duplicate_key_error(self, error: DuplicateKeyError) -> Exception:
+        return utils.BadBotArgument(f"Role group with name '{self.name}' already exists on this server!")
+
+    @classmethod
+    async def migrate(cls, database):
+        """
+        Renames groups with duplicate names in one guild (allowed before the unique index),
+        as the unique index can't be created otherwise. Group with the lowest priority keeps its name
+        """
+        collection = database[cls.__name__]
+        duplicates = collection.aggregate(
+            [
+                {"$sort": {"priority": ASCENDING, "_id": ASCENDING}},
+                {"$group": {"_id": {"guild_id": "$guild_id", "name": "$name"}, "ids": {"$push": "$_id"}}},
+                {"$match": {"ids.1": {"$exists": True}}},
+            ]
+        )
+        async for duplicate in duplicates:
+            guild_id, name = duplicate["_id"]["guild_id"], duplicate["_id"]["name"]
+            taken = set(await collection.distinct("name", {"guild_id": guild_id}))
+            for group_id in duplicate["ids"][1:]:
+                new_name = next(f"{name}_{n}" for n in itertools.count(2) if f"{name}_{n}" not in taken)
+                taken.add(new_name)
+                await collection.update_one({"_id": group_id}, {"$set": {"name": new_name}})
+                logger.error(
+                    f"Group {group_id} in guild {guild_id} has the same name '{name}' as another group, "
+                    f"renamed it to '{new_name}'"
+                )
 
-        # ensure priority
-        await db.ensure_priority(cls.find(cls.guild_id == self.guild_id), self.priority)
+    @after_event(Insert, Replace, SaveChanges)
+    def update_role_index(self):
+        role_index.update_group(self)
 
     def __str__(self) -> str:
         return self.name
@@ -100,6 +140,11 @@ class BotRole(Document):
     # Validators
     validate_emoji = validator("emoji", allow_reuse=True)(db.validate_emoji)
 
+    class Settings(Document.Settings):
+        indexes = [
+            IndexModel([("group.$id", ASCENDING), ("assignable", ASCENDING)], name="group_assignable"),
+        ]
+
     @staticmethod
     def group_request(group: RoleGroup):
         return {"group.$id": group.id}
@@ -115,6 +160,11 @@ class RoleSelectorMessage(Document):
     group: Link[RoleGroup]
     location: str  # Guild and channel, just to make it easier to look at raw DB data
 
+    class Settings(Document.Settings):
+        indexes = [
+            IndexModel([("group.$id", ASCENDING)], name="group"),
+        ]
+
     @staticmethod
     def group_request(group: RoleGroup):
         return {"group.$id": group.id}
@@ -124,28 +174,363 @@ def to_option_value(option: str):
     return option.replace(" ", "_")
 
 
+db.register_query_shape(RoleGroup, "by guild", {"guild_id": 0})
+db.register_query_shape(RoleGroup, "by guild and name", {"guild_id": 0, "name": ""})
+db.register_query_shape(BotRole, "by role", {"role_id": 0})
+db.register_query_shape(BotRole, "by groups", {"group.$id": {"$in": [ObjectId()]}})
+db.register_query_shape(BotRole, "assignable by group", {"group.$id": ObjectId(), "assignable": True})
+db.register_query_shape(RoleSelectorMessage, "by message", {"message_id": 0})
+db.register_query_shape(RoleSelectorMessage, "by groups", {"group.$id": {"$in": [ObjectId()]}})
+
+
+SELECTOR_SELECT_ID = "static_role_select"
+SELECTOR_CLEAR_ID = "static_role_clear_roles"
+
+
+def encode_selector_id(prefix: str, group_id: PydanticObjectId, version: str) -> str:
+    return f"{prefix}:{group_id}:{version}"
+
+
+def decode_selector_id(custom_id: str) -> Tuple[str, Optional[PydanticObjectId], Optional[str]]:
+    """Returns prefix, group ID and render version of selector component. Legacy selectors have only prefix"""
+    prefix, *data = custom_id.split(":")
+    # Listener receives all components of the bot, so custom IDs of other components are never parsed
+    if prefix not in (SELECTOR_SELECT_ID, SELECTOR_CLEAR_ID) or len(data) != 2:
+        return prefix, None, None
+    group_id, version = data
+    if not ObjectId.is_valid(group_id):
+        return prefix, None, None
+    return prefix, PydanticObjectId(group_id), version
+
+
+def link_id(link: Union[Link, Document]) -> PydanticObjectId:
+    """Returns ID of the linked document, works both for fetched and not fetched links"""
+    if isinstance(link, Link):
+        return link.ref.id
+    return link.id
+
+
+index_versions = itertools.count()
+
+
+@attr.frozen()
+class RoleRecord:
+    """Read-only slim view of BotRole for index and render paths, built without model validation"""
+
+    id: PydanticObjectId
+    role_id: int
+    name: str
+    group_id: PydanticObjectId
+    assignable: bool = False
+    description: str = ""
+    emoji: Optional[str] = None
+
+    FIELDS = ["role_id", "name", "group", "assignable", "description", "emoji"]
+
+    @classmethod
+    def from_raw(cls, raw: dict) -> "RoleRecord":
+        return cls(
+            id=PydanticObjectId(raw["_id"]),
+            role_id=raw["role_id"],
+            name=raw["name"],
+            group_id=PydanticObjectId(raw["group"].id),  # DBRef
+            assignable=raw.get("assignable", False),
+            description=raw.get("description", ""),
+            emoji=raw.get("emoji"),
+        )
+
+    @classmethod
+    def from_document(cls, db_role: BotRole) -> "RoleRecord":
+        return cls(
+            id=db_role.id,
+            role_id=db_role.role_id,
+            name=db_role.name,
+            group_id=link_id(db_role.group),
+            assignable=db_role.assignable,
+            description=db_role.description,
+            emoji=db_role.emoji,
+        )
+
+
+@attr.define()
+class GuildRoleIndex:
+    """In-memory view of role groups, tracked roles and selector messages of one guild"""
+
+    guild_id: int
+    groups: dict[PydanticObjectId, RoleGroup] = attr.field(factory=dict)
+    group_names: dict[str, PydanticObjectId] = attr.field(factory=dict)  # group DB name -> group ID
+    group_roles: dict[PydanticObjectId, list[RoleRecord]] = attr.field(factory=dict)
+    roles: dict[int, RoleRecord] = attr.field(factory=dict)  # Discord role ID -> role record
+    selectors: dict[int, RoleSelectorMessage] = attr.field(factory=dict)  # Discord message ID -> selector
+
+    fuzzy_group_names: dict[str, Optional[str]] = attr.field(factory=dict)  # query -> fuzzy matched group name
+    # Changes on every change of groups or roles, invalidates fuzzy indexes. Unique across reloads of the index
+    version: int = attr.field(factory=lambda: next(index_versions))
+
+    def add_group(self, group: RoleGroup):
+        self.version = next(index_versions)
+        # Group might be renamed, so old name is always removed
+        self._remove_group_name(group.id)
+        self.groups[group.id] = group
+        self.group_names[db.to_db_name(group.name)] = group.id
+        self.group_roles.setdefault(group.id, [])
+
+    def remove_group(self, group_id: PydanticObjectId):
+        self.version = next(index_versions)
+        self._remove_group_name(group_id)
+        self.groups.pop(group_id, None)
+        for db_role in self.group_roles.pop(group_id, []):
+            self.roles.pop(db_role.role_id, None)
+        for message_id, selector in list(self.selectors.items()):
+            if link_id(selector.group) == group_id:
+                del self.selectors[message_id]
+
+    def _remove_group_name(self, group_id: PydanticObjectId):
+        self.group_names = {name: name_id for name, name_id in self.group_names.items() if name_id != group_id}
+        self.fuzzy_group_names.clear()
+
+    def get_group_by_name(self, name: str) -> Optional[RoleGroup]:
+        group_id = self.group_names.get(db.to_db_name(name))
+        return self.groups[group_id] if group_id is not None else None
+
+    async def fuzzy_find_group(self, name: str) -> Optional[RoleGroup]:
+        name = db.to_db_name(name)
+        if name not in self.fuzzy_group_names:
+            index = get_dynamic_index(("group_names", self.guild_id), self.version, lambda: list(self.group_names.keys()))
+            self.fuzzy_group_names[name] = await index.find_async(name)
+        fuzzy_name = self.fuzzy_group_names[name]
+        return self.get_group_by_name(fuzzy_name) if fuzzy_name is not None else None
+
+    def add_role(self, db_role: RoleRecord):
+        # Role might be moved to the other group, so it's always re-added
+        self.remove_role(db_role.role_id)
+        self.version = next(index_versions)
+        self.roles[db_role.role_id] = db_role
+        self.group_roles.setdefault(db_role.group_id, []).append(db_role)
+
+    def remove_role(self, role_id: int) -> Optional[RoleRecord]:
+        db_role = self.roles.pop(role_id, None)
+        if db_role is not None:
+            self.version = next(index_versions)
+            for group_roles in self.group_roles.values():
+                group_roles[:] = [group_role for group_role in group_roles if group_role.role_id != role_id]
+        return db_role
+
+    def get_group_roles(self, group_id: PydanticObjectId, only_assignable: bool = False) -> list[RoleRecord]:
+        db_roles = self.group_roles.get(group_id, [])
+        if only_assignable:
+            return [db_role for db_role in db_roles if db_role.assignable]
+        return list(db_roles)
+
+    def count_group_roles(self, group_id: PydanticObjectId) -> int:
+        return len(self.group_roles.get(group_id, []))
+
+    def add_selector(self, selector: RoleSelectorMessage):
+        self.selectors[selector.message_id] = selector
+
+    def remove_selector(self, message_id: int) -> Optional[RoleSelectorMessage]:
+        return self.selectors.pop(message_id, None)
+
+    def get_group_selectors(self, group_id: PydanticObjectId) -> list[RoleSelectorMessage]:
+        return [selector for selector in self.selectors.values() if link_id(selector.group) == group_id]
+
+
+@attr.define()
+class RoleIndex:
+    """
+    Per-guild in-memory index of tracked roles, so hot paths (selector clicks, role assignment) don't hit the DB.
+    Guilds are loaded in bulk on startup and lazily on the first access after that.
+    """
+
+    guilds: dict[int, GuildRoleIndex] = attr.field(factory=dict)
+    _lock: asyncio.Lock = attr.field(factory=asyncio.Lock, init=False)
+
+    async def load(self, guild_ids: Optional[list[int]] = None):
+        """(Re)loads indexes for selected guilds, or for all guilds if guild_ids is None"""
+        groups_query = RoleGroup.find_all() if guild_ids is None else RoleGroup.find(In(RoleGroup.guild_id, guild_ids))
+        groups = await groups_query.to_list()
+        group_ids = [group.id for group in groups]
+        raw_roles = await BotRole.find_projected({"group.$id": {"$in": group_ids}}, RoleRecord.FIELDS)
+        db_roles = [RoleRecord.from_raw(raw) for raw in raw_roles]
+        selectors = await RoleSelectorMessage.find(In("group.$id", group_ids)).to_list()
+
+        indexes = {guild_id: GuildRoleIndex(guild_id) for guild_id in guild_ids or []}
+        guild_by_group = {}
+        for group in groups:
+            if group.guild_id not in indexes:
+                indexes[group.guild_id] = GuildRoleIndex(group.guild_id)
+            indexes[group.guild_id].add_group(group)
+            guild_by_group[group.id] = group.guild_id
+        for db_role in db_roles:
+            indexes[guild_by_group[db_role.group_id]].add_role(db_role)
+        for selector in selectors:
+            indexes[guild_by_group[link_id(selector.group)]].add_selector(selector)
+
+        self.guilds.update(indexes)
+        logger.db(f"Loaded role index for {len(indexes)} guilds: {len(groups)} groups, {len(db_roles)} roles")
+
+    async def get(self, guild_id: int) -> GuildRoleIndex:
+        if guild_id not in self.guilds:
+            async with self._lock:
+                if guild_id not in self.guilds:
+                    await self.load([guild_id])
+        return self.guilds[guild_id]
+
+    def update_group(self, group: RoleGroup):
+        """Updates the group in the index of its guild, if that index is loaded"""
+        if index := self.guilds.get(group.guild_id):
+            index.add_group(group)
+
+    def invalidate(self, guild_id: int):
+        """Drops index of the guild, it will be reloaded from the database on the next access"""
+        self.guilds.pop(guild_id, None)
+
+
+role_index = RoleIndex()
+
+
+async def get_role_index_version(ctx: AutocompleteContext) -> int:
+    """Version of groups and roles of the guild, cached group autocompletes of other versions are outdated"""
+    return (await role_index.get(ctx.guild_id)).version
+
+
+def get_role_group_index(
+    index: GuildRoleIndex, additional_options: List[str] = None, hide_empty: bool = False
+) -> FuzzyIndex:
+    """Fuzzy index of group names (and additional options) of the guild, rebuilt only when groups or roles change"""
+
+    def get_choices() -> list[str]:
+        groups = list(index.groups.values())
+        if hide_empty:
+            groups = [group for group in groups if index.count_group_roles(group.id)]
+        groups_list = []
+        if additional_options:
+            groups_list.extend(additional_options)
+        groups_list.extend(g.display_name for g in groups)
+        return groups_list
+
+    key = ("group_autocomplete", index.guild_id, tuple(additional_options or ()), hide_empty)
+    return get_dynamic_index(key, index.version, get_choices)
+
+
+def role_group_prefix_choices(
+    ctx: AutocompleteContext, group: str, additional_options: List[str] = None, hide_empty: bool = False
+) -> list[str]:
+    """Degraded role group autocomplete: group names, that start with the query"""
+    index = role_index.guilds.get(ctx.guild_id)
+    if index is None:
+        return []
+    fuzzy_index = get_role_group_index(index, additional_options, hide_empty)
+    return [name for name, _, _ in fuzzy_index.prefix_autocomplete(group)]
+
+
+@attr.define()
+class RolesSyncResult:
+    deleted: set[str] = attr.field(factory=set)  # names of deleted roles
+    renamed: dict[str, str] = attr.field(factory=dict)  # old name -> new name
+    timings: dict[str, float] = attr.field(factory=dict)  # phase -> duration in seconds
+
+
+@attr.define()
+class GuildSyncRecord:
+    started_at: datetime
+    duration: float = 0  # seconds
+    outcome: str = "running"
+
+
+@attr.define()
+class SelectorRenderCache:
+    """Rendered selector payloads, keyed by group ID and hash of the group state"""
+
+    payloads: dict[PydanticObjectId, tuple[str, dict]] = attr.field(factory=dict)
+    rendered: dict[int, str] = attr.field(factory=dict)  # Discord message ID -> state hash of the rendered payload
+
+    hits: int = 0
+    misses: int = 0
+    skipped_edits: int = 0
+
+    def get(self, group_id: PydanticObjectId, state_hash: str) -> Optional[dict]:
+        cached_hash, payload = self.payloads.get(group_id, (None, None))
+        if cached_hash == state_hash:
+            self.hits += 1
+            return payload
+        self.misses += 1
+        return None
+
+    def put(self, group_id: PydanticObjectId, state_hash: str, payload: dict):
+        self.payloads[group_id] = (state_hash, payload)
+
+    def get_hash(self, group_id: PydanticObjectId) -> Optional[str]:
+        return self.payloads.get(group_id, (None, None))[0]
+
+    def is_rendered(self, message_id: int, state_hash: str) -> bool:
+        return self.rendered.get(message_id) == state_hash
+
+    def mark_rendered(self, message_id: int, state_hash: str):
+        self.rendered[message_id] = state_hash
+
+    def get_stats(self) -> dict[str, int]:
+        return {
+            "cache hits": self.hits,
+            "cache misses": self.misses,
+            "skipped edits": self.skipped_edits,
+        }
+
+
 class RoleSelector(Scale):
     bot: "Bot"
 
     delete_roles_option = "< Delete roles >"
 
-    # def __init__(self, client):
-    # self.add_scale_check(dis_snek.guild_only())
+    def __init__(self, client):
+        # self.add_scale_check(dis_snek.guild_only())
+        # Selectors are re-rendered once per group after a quiet window, so bulk operations don't spam message edits
+        self.render_queue = Debouncer(self.render_group_selectors, delay=self.bot.config.selector_render_delay)
+        self.render_cache = SelectorRenderCache()
+
+        # Periodic sync state
+        self.roles_fingerprints: dict[int, int] = {}  # guild ID -> fingerprint of the guild roles at the last sync
+        self.sync_records: dict[int, GuildSyncRecord] = {}  # guild ID -> last sync record
+
+    def get_stats(self) -> dict[str, dict[str, Any]]:
+        sync_outcomes = {}
+        for record in self.sync_records.values():
+            outcome = record.outcome.split(":")[0]
+            sync_outcomes[outcome] = sync_outcomes.get(outcome, 0) + 1
+        if self.sync_records:
+            sync_outcomes["max duration"] = f"{max(r.duration for r in self.sync_records.values()) * 1000:.1f}ms"
+
+        return {
+            "Selector renders": self.render_queue.get_stats(),
+            "Selector render cache": self.render_cache.get_stats(),
+            "Periodic roles sync": sync_outcomes,
+        }
 
     @dis_snek.listen()
     async def on_startup(self) -> None:
-        sync_task = tasks.Task(self.sync_roles_task, tasks.triggers.IntervalTrigger(hours=6))
+        await role_index.load()
+
+        sync_task = tasks.Task(
+            self.sync_roles_task,
+            tasks.triggers.IntervalTrigger(hours=self.bot.config.roles_sync_interval_hours),
+        )
         sync_task.start()
-        await sync_task()
+        await self.sync_roles_task(spread=False)
 
     @dis_snek.listen()
     async def on_message_delete(self, event: dis_snek.events.MessageDelete):
         deleted_message = event.message
-        selector = await RoleSelectorMessage.find_one(RoleSelectorMessage.message_id == int(deleted_message.id), fetch_links=True)
+        if deleted_message.guild is None:
+            return
+
+        index = await role_index.get(deleted_message.guild.id)
+        selector = index.remove_selector(int(deleted_message.id))
         if selector:
-            logger.db(f"Removing selector for group {selector.group.display_name} from database on message deletion"
+            group = index.groups[link_id(selector.group)]
+            logger.db(f"Removing selector for group {group.display_name} from database on message deletion"
                       f" in #{deleted_message.channel.name} in {deleted_message.guild.name}")
             await selector.delete()
+            self.render_cache.rendered.pop(selector.message_id, None)
 
     # TODO: Help button?
     # status: done, tested
@@ -166,6 +551,7 @@ class RoleSelector(Scale):
         send_params = await self.create_selector_send_params(group=group, guild=ctx.guild)
 
         message = await ctx.send(**send_params)
+        self.render_cache.mark_rendered(message.id, self.render_cache.get_hash(group.id))
         message_tracker = RoleSelectorMessage(
             message_id=message.id,
             channel_id=message.channel.id,
@@ -173,40 +559,93 @@ class RoleSelector(Scale):
             location=f"#{message.channel.name} at {message.guild.name}"
         )
         await message_tracker.insert()
+        (await role_index.get(ctx.guild_id)).add_selector(message_tracker)
         logger.command(ctx, f"Created a selector for group {group.display_name} in {ctx.channel}")
 
     @create_static.autocomplete("group")
+    @cached_autocomplete(
+        version=get_role_index_version,
+        fallback=functools.partial(role_group_prefix_choices, hide_empty=True),
+    )
     async def _create_static_group(self, ctx: AutocompleteContext, group: str, **kwargs):
         return await self.role_group_autocomplete(ctx, group, hide_empty=True)
 
     # status: done, not tested
-    @component_callback("static_role_select")
+    @component_callback(SELECTOR_SELECT_ID)
     async def give_roles_static(self, ctx: ComponentContext):
+        """Handles legacy selectors, custom ID of which doesn't contain group ID"""
+        with self.bot.query_monitor.profile(f"component {SELECTOR_SELECT_ID}"):
+            await self.selector_select(ctx)
+
+    # status: done, not tested
+    @component_callback(SELECTOR_CLEAR_ID)
+    async def clear_roles_static(self, ctx: ComponentContext):
+        """Handles legacy selectors, custom ID of which doesn't contain group ID"""
+        with self.bot.query_monitor.profile(f"component {SELECTOR_CLEAR_ID}"):
+            await self.selector_clear(ctx)
+
+    @dis_snek.listen()
+    async def on_component(self, event: dis_snek.events.Component):
+        ctx = event.context
+        prefix, group_id, _ = decode_selector_id(ctx.custom_id)
+        if group_id is None:
+            return  # not a selector or legacy selector
+
+        with self.bot.query_monitor.profile(f"component {prefix}"):
+            if prefix == SELECTOR_SELECT_ID:
+                await self.selector_select(ctx)
+            elif prefix == SELECTOR_CLEAR_ID:
+                await self.selector_clear(ctx)
+
+    async def resolve_selector(self, ctx: ComponentContext) -> Tuple[GuildRoleIndex, RoleGroup]:
+        """
+        Gets group of the selector from the component custom ID (or from the tracked message for legacy selectors).
+        Schedules re-rendering of the selector, if it was rendered for the outdated state of the group
+        """
+        index = await role_index.get(ctx.guild_id)
+        _, group_id, version = decode_selector_id(ctx.custom_id)
+        if group_id is None:
+            group_id = link_id(self.get_message_tracker(index, ctx).group)
+
+        group = index.groups.get(group_id)
+        if group is None:
+            raise utils.BadBotArgument("Group of this selector doesn't exist anymore, please ask for a new selector")
+
+        db_roles = index.get_group_roles(group.id, only_assignable=True)
+        if version != self.get_selector_state_hash(group, db_roles, ctx.guild):
+            logger.info(f"Selector for group {group.display_name} in {ctx.guild.name} is stale, re-rendering it")
+            self.render_cache.rendered.pop(int(ctx.data["message"]["id"]), None)
+            await self.on_group_roles_change(group=group, guild=ctx.guild)
+
+        return index, group
+
+    async def selector_select(self, ctx: ComponentContext):
         await ctx.defer(ephemeral=True)
 
-        message_id = int(ctx.data["message"]["id"])
-        message_tracker = await RoleSelectorMessage.find_one(RoleSelectorMessage.message_id == message_id)
-        # channel_id = message_tracker.channel_id
-        # message = await self.bot.cache.get_message(channel_id, message_id)
+        index, group = await self.resolve_selector(ctx)
 
-        choices = ctx.values
-        choices = [ObjectId(choice) for choice in choices]
+        # Option values are discord role IDs (or BotRole IDs for legacy selectors)
+        choices = set(ctx.values)
         to_add = []
         to_remove = []
-        async for db_role in BotRole.find(BotRole.group_link_request(message_tracker.group)):
-            role = await ctx.guild.fetch_role(db_role.role_id)
-            if db_role.id in choices:
+        for db_role in index.get_group_roles(group.id):
+            role = ctx.guild.get_role(db_role.role_id)
+            if role is None:
+                continue
+            if str(db_role.role_id) in choices or str(db_role.id) in choices:
                 if role not in ctx.author.roles:
                     to_add.append(role)
             else:
                 if role in ctx.author.roles:
                     to_remove.append(role)
 
+        # All changes are collected and applied with a single request
+        roles_edit = utils.MemberRolesEdit(ctx.author)
         for role in to_remove:
             try:
-                await self.try_remove_role(
+                await self.plan_role_remove(
+                    roles_edit,
                     requester=ctx.author,
-                    target=ctx.author,
                     role=role,
                     reason=f"Self-removed using {self.bot.user.display_name}'s selector",
                 )
@@ -215,15 +654,20 @@ class RoleSelector(Scale):
 
         for role in to_add:
             try:
-                await self.try_assign_role(
+                await self.plan_role_assign(
+                    roles_edit,
                     requester=ctx.author,
-                    target=ctx.author,
                     role=role,
                     reason=f"Self-assigned using {self.bot.user.display_name}'s selector",
                 )
             except Exception as e:
                 logger.warning(f"Exception while assigning role {role} to {ctx.author} via static select: {e}")
 
+        try:
+            await roles_edit.apply()
+        except Exception as e:
+            logger.warning(f"Exception while updating roles of {ctx.author} via static select: {e}")
+
         added = " ".join([role.mention for role in to_add])
         removed = " ".join([role.mention for role in to_remove])
         if not added and not removed:
@@ -244,12 +688,9 @@ class RoleSelector(Scale):
         logger.command(ctx, f"Used role selector, added roles [{added}], removed roles [{removed}]")
 
     # status: done, not tested
-    @component_callback("static_role_clear_roles")
-    async def clear_roles_static(self, ctx: ComponentContext):
+    async def selector_clear(self, ctx: ComponentContext):
         await ctx.defer(ephemeral=True)
-        message_id = int(ctx.data["message"]["id"])
-        message_tracker = await RoleSelectorMessage.find_one(RoleSelectorMessage.message_id == message_id)
-        group = await message_tracker.group.fetch()
+        _, group = await self.resolve_selector(ctx)
 
         removed_roles = await self.try_remove_group(
             ctx.author,
@@ -277,6 +718,13 @@ class RoleSelector(Scale):
             )
             logger.command(ctx, f"Used role selector, no roles were removed")
 
+    @staticmethod
+    def get_message_tracker(index: GuildRoleIndex, ctx: ComponentContext) -> RoleSelectorMessage:
+        message_tracker = index.selectors.get(int(ctx.data["message"]["id"]))
+        if message_tracker is None:
+            raise utils.BadBotArgument("This selector is not tracked by bot anymore, please ask for a new one")
+        return message_tracker
+
     # Status: done, tested
     @subcommand(base="role", name="list")
     async def role_list(
@@ -292,7 +740,7 @@ class RoleSelector(Scale):
         if group:
             groups = [await self.role_group_find(group, ctx.guild)]
         else:
-            groups = await RoleGroup.find(RoleGroup.guild_id == ctx.guild_id).to_list()
+            groups = sorted((await role_index.get(ctx.guild_id)).groups.values(), key=lambda g: g.priority)
 
         if not only_assignable:
             only_assignable = not await Permissions.is_manager(ctx.author)
@@ -313,6 +761,7 @@ class RoleSelector(Scale):
         await ctx.send(embed=embed)  # allowed_mentions=dis_snek.AllowedMentions.none()
 
     @role_list.autocomplete("group")
+    @cached_autocomplete(version=get_role_index_version, fallback=role_group_prefix_choices)
     async def _role_list_group(self, ctx: AutocompleteContext, group: str, **kwargs):
         return await self.role_group_autocomplete(ctx, group)
 
@@ -422,6 +871,7 @@ class RoleSelector(Scale):
 
     # Status: done, tested
     @role_track_role.autocomplete("group")
+    @cached_autocomplete(version=get_role_index_version, fallback=role_group_prefix_choices)
     async def _role_track_role_group(self, ctx: AutocompleteContext, group: str, **kwargs):
         return await self.role_group_autocomplete(ctx, group)
 
@@ -438,7 +888,8 @@ class RoleSelector(Scale):
         if group:
             group = await self.role_group_find(group, ctx.guild, use_fuzzy_search=False)
 
-        to_track = [role for role in ctx.guild.roles if (await self.check_role_for_tracking(role))[0]]
+        checks = await self.check_roles_for_tracking(ctx.guild.roles)
+        to_track = [role for role in ctx.guild.roles if checks[role.id][0]]
 
         if not to_track:
             raise utils.BadBotArgument("Sorry, but there are no roles available for tracking")
@@ -463,18 +914,10 @@ class RoleSelector(Scale):
 
         response = await self.bot.wait_for_modal(modal, timeout=15 * 60)
         await response.defer()
-        new_roles = []
 
         roles_names = response.kwargs["roles_names"].split("\n")
-        roles_names = [name.strip() for name in roles_names]
-        for role in to_track:
-            if role.name in roles_names:
-                try:
-                    await self.track_role(ctx, role, group)
-                except utils.BadBotArgument:
-                    continue
-                else:
-                    new_roles.append(role)
+        roles_names = {name.strip() for name in roles_names}
+        new_roles = await self.track_roles(ctx, [role for role in to_track if role.name in roles_names], group)
 
         group_name = group.display_name if group else self.bot.config.default_manage_group
 
@@ -491,6 +934,7 @@ class RoleSelector(Scale):
 
     # Status: done, tested
     @role_track_all.autocomplete("group")
+    @cached_autocomplete(version=get_role_index_version, fallback=role_group_prefix_choices)
     async def _role_track_all_group(self, ctx: AutocompleteContext, group: str, **kwargs):
         return await self.role_group_autocomplete(ctx, group)
 
@@ -521,14 +965,14 @@ class RoleSelector(Scale):
         """Removes all roles, that are not available anymore, from the database, updates internal role names"""
         await ctx.defer(ephemeral=True)
 
-        deleted, renamed = await self.sync_roles_for_guild(ctx.guild)
+        result = await self.sync_roles_for_guild(ctx.guild)
 
         report = f"Synced db roles for {ctx.guild.name}."
-        if deleted:
-            report = report + f" Deleted {len(deleted)} roles."
-        if renamed:
-            report = report + f" Renamed {len(renamed)} roles."
-        if not deleted and not renamed:
+        if result.deleted:
+            report = report + f" Deleted {len(result.deleted)} roles."
+        if result.renamed:
+            report = report + f" Renamed {len(result.renamed)} roles."
+        if not result.deleted and not result.renamed:
             report = report + " No changes in database"
         await send_with_embed(ctx, report)
 
@@ -536,19 +980,53 @@ class RoleSelector(Scale):
     @dis_snek.listen()
     async def on_role_delete(self, event):
         logger.info(f"Reacting on role deletion in {event.guild.name}")
-        await self.sync_roles_for_guild(event.guild)
+        await self.sync_role(event.guild, int(event.id), role=None)
 
     # status: done, tested
     @dis_snek.listen()
     async def on_role_update(self, event):
         logger.info(f"Reacting on role update in {event.guild.name}")
-        await self.sync_roles_for_guild(event.guild)
+        await self.sync_role(event.guild, int(event.after.id), role=event.after)
 
     # status: done, not tested
-    async def sync_roles_task(self):
+    async def sync_roles_task(self, spread: bool = True):
+        """Syncs all guilds concurrently, spreading them across the configured window"""
         logger.info("Running regular sync roles task")
-        for guild in self.bot.guilds:
-            await self.sync_roles_for_guild(guild)
+        window = self.bot.config.roles_sync_spread_minutes * 60 if spread else 0
+        timer = utils.PhaseTimer()
+        await run_spread(
+            self.sync_guild_if_changed,
+            list(self.bot.guilds),
+            window=window,
+            concurrency=self.bot.config.roles_sync_concurrency,
+        )
+        timer.lap("sync")
+        logger.info(f"Regular sync roles task for {len(self.bot.guilds)} guilds finished in {timer.format()}")
+
+    async def sync_guild_if_changed(self, guild: dis_snek.Guild):
+        """Syncs roles of the guild, unless the guild roles didn't change since the last sync"""
+        fingerprint = self.get_roles_fingerprint(guild)
+        record = GuildSyncRecord(started_at=datetime.now())
+        self.sync_records[guild.id] = record
+        started = time.perf_counter()
+
+        if self.roles_fingerprints.get(guild.id) == fingerprint:
+            record.outcome = "unchanged"
+        else:
+            try:
+                result = await self.sync_roles_for_guild(guild)
+            except Exception as e:
+                record.outcome = f"failed: {e}"
+                logger.error(f"Exception during roles sync for guild {guild.name}: {e}", exc_info=e)
+            else:
+                record.outcome = f"synced: {len(result.deleted)} deleted, {len(result.renamed)} renamed"
+                self.roles_fingerprints[guild.id] = fingerprint
+
+        record.duration = time.perf_counter() - started
+
+    @staticmethod
+    def get_roles_fingerprint(guild: dis_snek.Guild) -> int:
+        return hash(tuple(sorted((int(role.id), role.name, role.position) for role in guild.roles)))
 
     # Status: done, tested
     @subcommand(base="manage", subcommand_group="roles", name="edit")
@@ -568,9 +1046,10 @@ class RoleSelector(Scale):
         if group is None and description is None and emoji is None and assignable is None:
             raise utils.BadBotArgument("Nothing to change!")
 
-        db_role = await BotRole.find_one(BotRole.role_id == role.id, fetch_links=True)
+        db_role = await BotRole.find_one(BotRole.role_id == role.id)
         if not db_role:
             raise utils.BadBotArgument(f"Role {role.mention} is not in the database and not managed by bot")
+        await db.get_batch_loader().fetch_links([db_role])
 
         changes: dict[str, tuple[Any, Any]] = dict()
         old_group = None
@@ -611,6 +1090,7 @@ class RoleSelector(Scale):
                 logger.db(f"Changing {name}: '{before}' → '{after}'")
 
             await db_role.save()
+            (await role_index.get(ctx.guild_id)).add_role(RoleRecord.from_document(db_role))
             await self.on_group_roles_change(group=db_role.group, guild=ctx.guild)
             if old_group is not None:
                 await self.on_group_roles_change(group=old_group, guild=ctx.guild)  # type: ignore
@@ -624,6 +1104,7 @@ class RoleSelector(Scale):
             )
 
     @role_edit.autocomplete("group")
+    @cached_autocomplete(version=get_role_index_version, fallback=role_group_prefix_choices)
     async def _role_edit_group(self, ctx: AutocompleteContext, group: str, **kwargs):
         return await self.role_group_autocomplete(ctx=ctx, group=group)
 
@@ -654,6 +1135,7 @@ class RoleSelector(Scale):
 
     # Status: done, tested
     @group_add.autocomplete("color")
+    @cached_autocomplete(fallback=utils.color_prefix_choices)
     async def _group_add_color(self, ctx: AutocompleteContext, color: str, **kwargs):
         return await utils.color_autocomplete(ctx, color)
 
@@ -687,14 +1169,17 @@ class RoleSelector(Scale):
             # await group_roles.update(Set({BotManagedRole.group: transfer_group}))  # TODO wait for odmantic fix
             logger.db(f"Moving roles from {group.display_name} to {transfer_group.display_name} on group deletion")
             await group_roles.update(Set(BotRole.group_request(transfer_group)))
+            BotRole.invalidate_cache()
             await self.on_group_roles_change(group=transfer_group, guild=ctx.guild)
         else:
             logger.db(f"Deleting roles from {group.display_name} on group deletion")
             await group_roles.delete()
+            BotRole.invalidate_cache()
 
         await self.mark_selectors_deleted(group)
         logger.db(f"Deleting role group {group.display_name}")
         await group.delete()
+        role_index.invalidate(ctx.guild_id)
         roles_action_text = f"moved to '{transfer_group.display_name}'" if transfer_group else "untracked"
         await send_with_embed(
             ctx,
@@ -703,11 +1188,16 @@ class RoleSelector(Scale):
 
     # Status: done, tested
     @group_delete.autocomplete("group")
+    @cached_autocomplete(version=get_role_index_version, fallback=role_group_prefix_choices)
     async def _group_delete_group(self, ctx: AutocompleteContext, group: str, **kwargs):
         return await self.role_group_autocomplete(ctx, group)
 
     # Status: done, tested
     @group_delete.autocomplete("transfer_group")
+    @cached_autocomplete(
+        version=get_role_index_version,
+        fallback=functools.partial(role_group_prefix_choices, additional_options=[delete_roles_option]),
+    )
     async def _group_delete_transfer_group(self, ctx: AutocompleteContext, transfer_group: str, **kwargs):
         return await self.role_group_autocomplete(ctx, transfer_group, additional_options=[self.delete_roles_option])
 
@@ -717,7 +1207,7 @@ class RoleSelector(Scale):
         self,
         ctx: InteractionContext,
         group: slash_str_option("Group to edit", autocomplete=True, required=True),
-        priority: slash_int_option("Priority of the group (affects ordering)", required=False) = None,
+        priority: slash_int_option("Position of the group in the groups list, starting from 0", required=False) = None,
         name: slash_str_option("Name of the group", required=False) = None,
         color: slash_str_option("Color theme of the group", autocomplete=True, required=False) = None,
         exclusive_roles: slash_bool_option(
@@ -732,8 +1222,7 @@ class RoleSelector(Scale):
         group = await self.role_group_find(group_name=group, guild=ctx.guild, use_fuzzy_search=False)
         old_name = group.display_name
 
-        updated = dict(priority=priority,
-                       name=name, color=color,
+        updated = dict(name=name, color=color,
                        exclusive_roles=exclusive_roles,
                        description=description,
                        )
@@ -748,16 +1237,70 @@ class RoleSelector(Scale):
         # if description.lower() == "none":
         #     description = ""
 
+        try:
+            await group.save()
+            # Other groups might be rebalanced by the move, so it's done only after the group itself is saved
+            if priority is not None:
+                index = await role_index.get(ctx.guild_id)
+                if not await db.move_to_position(group, list(index.groups.values()), priority):
+                    await group.save()
+        except Exception:
+            # group object is shared with the role index, so it has to be reloaded from DB
+            role_index.invalidate(ctx.guild_id)
+            raise
+        (await role_index.get(ctx.guild_id)).add_group(group)
+
         await send_with_embed(ctx, f"Group {old_name} was successfully updated")
         await self.on_group_roles_change(group=group, guild=ctx.guild)
 
+    @check(Permissions.check_manager)
+    @subcommand(base="manage", subcommand_group="groups", name="reorder")
+    async def group_reorder(self, ctx: InteractionContext):
+        """Changes order of all groups at once"""
+        index = await role_index.get(ctx.guild_id)
+        groups = sorted(index.groups.values(), key=lambda g: g.priority)
+        if not groups:
+            raise utils.BadBotArgument("There are no groups on this server yet")
+
+        modal = Modal(
+            title="Reorder groups",
+            components=[
+                ShortText(
+                    label="Instructions",
+                    value="Reorder lines below, missing groups are put at the end",
+                    required=False,
+                ),
+                ParagraphText(
+                    label="Groups in the new order",
+                    custom_id="groups_names",
+                    value="\n".join(group.display_name for group in groups),
+                ),
+            ],
+        )
+        await ctx.send_modal(modal)
+
+        response = await self.bot.wait_for_modal(modal, timeout=15 * 60)
+        await response.defer(ephemeral=True)
+
+        ordered = []
+        for name in response.kwargs["groups_names"].split("\n"):
+            group = index.get_group_by_name(name.strip())
+            if group is not None and group not in ordered:
+                ordered.append(group)
+        ordered.extend(group for group in groups if group not in ordered)
+
+        await db.reorder(ordered)
+        await send_with_embed(response, "New groups order: " + ", ".join(group.display_name for group in ordered))
+
     # Status: done, tested
     @group_edit.autocomplete("group")
+    @cached_autocomplete(version=get_role_index_version, fallback=role_group_prefix_choices)
     async def _group_edit_group(self, ctx: AutocompleteContext, group: str, **kwargs):
         return await self.role_group_autocomplete(ctx, group)
 
     # Status: done, tested
     @group_edit.autocomplete("color")
+    @cached_autocomplete(fallback=utils.color_prefix_choices)
     async def _group_edit_color(self, ctx: AutocompleteContext, color: str, **kwargs):
         return await utils.color_autocomplete(ctx, color)
 
@@ -783,6 +1326,10 @@ class RoleSelector(Scale):
             title="Edit fields you want to change",
             ephemeral_response=False,
         )
+        index = await role_index.get(ctx.guild_id)
+        for db_role in editor.edited:
+            index.add_role(RoleRecord.from_document(db_role))
+
         if editor.edited:
             await response_message.edit(f"Updated {len(editor.edited)} roles")
         else:
@@ -790,6 +1337,7 @@ class RoleSelector(Scale):
 
     # Status: done, tested
     @group_edit_roles.autocomplete("group")
+    @cached_autocomplete(version=get_role_index_version, fallback=role_group_prefix_choices)
     async def _group_edit_roles_group(self, ctx: AutocompleteContext, group: str, **kwargs):
         return await self.role_group_autocomplete(ctx, group)
 
@@ -812,21 +1360,12 @@ class RoleSelector(Scale):
             raise utils.BadBotArgument(f"'{emoji}' is not a valid emoji")
 
         if not group:
-            # when no group specified, try to find DEFAULT group for this server or create it
-            group = await RoleGroup.find_one(
-                RoleGroup.name == self.bot.config.default_manage_group,
-                RoleGroup.guild_id == ctx.guild_id,
-            )
-            if not group:
-                group = await self.create_new_role_group(
-                    guild=ctx.guild,
-                    name=self.bot.config.default_manage_group,
-                    description=self.bot.config.default_manage_group_desc,
-                )
+            group = await self.get_default_group(ctx.guild)
 
         # Check that we can add more roles to the group, if that's not a default group
+        index = await role_index.get(ctx.guild_id)
         if group.name != self.bot.config.default_manage_group:
-            existing_roles_num = await BotRole.find(BotRole.group_request(group)).count()
+            existing_roles_num = len(index.get_group_roles(group.id))
             if existing_roles_num >= self.bot.config.max_roles_in_group:
                 raise utils.BadBotArgument(
                     f"Group {group.display_name} has too much roles already! "
@@ -843,16 +1382,63 @@ class RoleSelector(Scale):
         )
         logger.db(f"Adding tracked role {db_role.name} in group {group.display_name}")
         await db_role.insert()
+        index.add_role(RoleRecord.from_document(db_role))
+        await self.on_group_roles_change(group=group, guild=ctx.guild)
+
+    async def track_roles(
+        self,
+        ctx: InteractionContext,
+        roles: list[Role],
+        group: Optional[RoleGroup] = None,
+    ) -> list[Role]:
+        """Adds multiple roles to the internal database with a single insert. Returns list of roles, that were added"""
+        checks = await self.check_roles_for_tracking(roles)
+        roles = [role for role in roles if checks[role.id][0]]
+
+        if not group:
+            group = await self.get_default_group(ctx.guild)
+
+        # Check that we can add more roles to the group, if that's not a default group
+        index = await role_index.get(ctx.guild_id)
+        if group.name != self.bot.config.default_manage_group:
+            free_slots = self.bot.config.max_roles_in_group - len(index.get_group_roles(group.id))
+            roles = roles[: max(free_slots, 0)]
+
+        if not roles:
+            return []
+
+        db_roles = [BotRole(role_id=role.id, group=group, name=role.name) for role in roles]
+        logger.db(f"Adding {len(db_roles)} tracked roles in group {group.display_name}")
+        result = await BotRole.insert_many(db_roles)
+        for db_role, inserted_id in zip(db_roles, result.inserted_ids):
+            db_role.id = inserted_id
+            index.add_role(RoleRecord.from_document(db_role))
+
         await self.on_group_roles_change(group=group, guild=ctx.guild)
+        return roles
+
+    async def get_default_group(self, guild: Guild) -> RoleGroup:
+        """Finds DEFAULT group for this server or creates it"""
+        group = (await role_index.get(guild.id)).get_group_by_name(self.bot.config.default_manage_group)
+        if not group:
+            group = await self.create_new_role_group(
+                guild=guild,
+                name=self.bot.config.default_manage_group,
+                description=self.bot.config.default_manage_group_desc,
+            )
+        return group
 
     # status: done, tested
     async def stop_role_tracking(self, role_id: int, guild: Guild):
         """Removes role from internal database by ID"""
-        db_role = await BotRole.find_one(BotRole.role_id == role_id, fetch_links=True)
+        db_role = await BotRole.find_one(BotRole.role_id == role_id)
         if db_role:
             logger.db(f"Removing tracked role {db_role.name}")
             await db_role.delete()
-            await self.on_group_roles_change(group=db_role.group, guild=guild)  # type: ignore
+            (await role_index.get(guild.id)).remove_role(role_id)
+            group = await db.get_batch_loader().fetch_link(db_role.group)
+            if group is not None:
+                await self.on_group_roles_change(group=group, guild=guild)
         else:
             raise utils.BadBotArgument(f"Role with ID {role_id} is not managed by bot")
 
@@ -867,8 +1453,8 @@ class RoleSelector(Scale):
     ):
         """Creates a new role group for the guild, checks for collisions"""
 
-        priority = await RoleGroup.find(RoleGroup.guild_id == guild.id).max("priority") or -1
-        priority = priority + 1
+        index = await role_index.get(guild.id)
+        priority = db.next_priority(list(index.groups.values()))
         group = RoleGroup(
             guild_id=guild.id,
             priority=priority,
@@ -879,6 +1465,7 @@ class RoleSelector(Scale):
         )
         logger.db(f"Adding group {group.display_name}")
         await group.insert()
+        index.add_group(group)
         return group
 
     # status: done, not tested
@@ -890,19 +1477,9 @@ class RoleSelector(Scale):
         hide_empty: bool = False,
     ):
         """Autocompletes role groups request with optional additional options"""
-        groups = await RoleGroup.find(RoleGroup.guild_id == ctx.guild_id).to_list()
-        if hide_empty:
-            # TODO: optimize plz maybe. distinct? cross-query? lol you wish
-            group_ids = [ObjectId(group.id) for group in groups]
-            roles_in_groups = await BotRole.find(In("group.$id", group_ids)).to_list()
-            group_ids = {role.group.ref.id for role in roles_in_groups}
-            groups = await RoleGroup.find(In(RoleGroup.id, group_ids)).to_list()
-        groups_list = []
-        if additional_options:
-            groups_list.extend(additional_options)
-        groups_list.extend(g.display_name for g in groups)
-
-        results = fuzzy_autocomplete(group, groups_list)
+        index = await role_index.get(ctx.guild_id)
+        fuzzy_index = get_role_group_index(index, additional_options, hide_empty)
+        results = await fuzzy_index.autocomplete_async(group)
         results = [value[0] for value in results]
         await ctx.send(results)
 
@@ -914,33 +1491,58 @@ class RoleSelector(Scale):
         Raises utils.BadBotArgument if fails to find it
         """
         group_name = db.to_db_name(group_name)
+        index = await role_index.get(guild.id)
 
         # try and get role group with exact same name
-        group = await RoleGroup.find_one(RoleGroup.name == group_name, RoleGroup.guild_id == guild.id)
+        group = index.get_group_by_name(group_name)
         if group is None:  # user gave us incorrect or incomplete role name
             if not use_fuzzy_search:
                 raise utils.BadBotArgument(f"Can't find a group '{group_name}' for this server!")
 
-            groups = await RoleGroup.find(RoleGroup.guild_id == guild.id).to_list()
-            groups_list = [g.name for g in groups]
-            fuzzy_group_name = fuzzy_find(group_name, groups_list)
-            if fuzzy_group_name is None:
+            group = await index.fuzzy_find_group(group_name)
+            if group is None:
                 raise utils.BadBotArgument(f"Can't find a group '{group_name}' for this server!")
 
-            group = await RoleGroup.find_one(RoleGroup.name == fuzzy_group_name, RoleGroup.guild_id == guild.id)
-
         return group
 
     # status: done, tested
-    @staticmethod
+    @classmethod
     async def try_assign_role(
+        cls,
         requester: dis_snek.Member,
         target: dis_snek.Member,
         role: dis_snek.Role,
         reason: Absent[str] = MISSING,
     ):
         """Tries to assign a role to a target. Returns list of unassigned roles as a result or raises utils.BadBotArgument"""
-        db_role = await BotRole.find_one(BotRole.role_id == role.id)
+        roles_edit = utils.MemberRolesEdit(target)
+        await cls.plan_role_assign(roles_edit, requester, role, reason)
+        await roles_edit.apply()
+
+    # Status: done, tested
+    @classmethod
+    async def try_remove_role(
+        cls,
+        requester: dis_snek.Member,
+        target: dis_snek.Member,
+        role: dis_snek.Role,
+        reason: Absent[str] = MISSING,
+    ):
+        roles_edit = utils.MemberRolesEdit(target)
+        await cls.plan_role_remove(roles_edit, requester, role, reason)
+        await roles_edit.apply()
+
+    @staticmethod
+    async def plan_role_assign(
+        roles_edit: utils.MemberRolesEdit,
+        requester: dis_snek.Member,
+        role: dis_snek.Role,
+        reason: Absent[str] = MISSING,
+    ):
+        """Checks, if requester can assign a role and adds it (and removal of conflicting roles) to the roles edit"""
+        target = roles_edit.member
+        index = await role_index.get(target.guild.id)
+        db_role = index.roles.get(role.id)
         if not db_role:
             raise utils.BadBotArgument(
                 f"Trying to assign role {role.mention}, that is not in the database! Probably you shouldn't do it"
@@ -951,34 +1553,32 @@ class RoleSelector(Scale):
                 raise utils.BadBotArgument("Trying to assign role without a permissions to do it!")
 
         # remove conflicting roles
-        group = await db_role.group.fetch()
+        group = index.groups[db_role.group_id]
         if group.exclusive_roles:
-            target_roles = {target_role.id: target_role for target_role in target.roles}
-            db_roles = BotRole.find(
-                BotRole.group_request(group),
-                In(BotRole.role_id, list(target_roles.keys())),
-            )
-            async for db_role in db_roles:
-                role_to_remove = target_roles[db_role.role_id]
+            group_role_ids = {group_role.role_id for group_role in index.get_group_roles(group.id)}
+            conflicting_roles = [target_role for target_role in target.roles if target_role.id in group_role_ids]
+            for role_to_remove in conflicting_roles:
                 logger.important(f"Removing role {role_to_remove} from {target} since it conflicts with {role}")
-                await target.remove_role(
+                roles_edit.remove(
                     role_to_remove,
                     reason=f"Removing a conflicting role from group {group.display_name} "
                     f"when assigning '{role.name}' by {requester.display_name}",
                 )
 
         logger.important(f"Adding role {role} to {target} by {requester} request")
-        await target.add_role(role, reason=reason)
+        roles_edit.add(role, reason=reason)
 
-    # Status: done, tested
     @staticmethod
-    async def try_remove_role(
+    async def plan_role_remove(
+        roles_edit: utils.MemberRolesEdit,
         requester: dis_snek.Member,
-        target: dis_snek.Member,
         role: dis_snek.Role,
         reason: Absent[str] = MISSING,
     ):
-        db_role = await BotRole.find_one(BotRole.role_id == role.id)
+        """Checks, if requester can remove a role and adds its removal to the roles edit"""
+        target = roles_edit.member
+        index = await role_index.get(target.guild.id)
+        db_role = index.roles.get(role.id)
         if not db_role:
             raise utils.BadBotArgument(
                 f"Trying to remove role {role.mention}, that is not in the database! Probably you shouldn't do it"
@@ -989,7 +1589,7 @@ class RoleSelector(Scale):
                 raise utils.BadBotArgument("Trying to unassign role without a permissions to do it!")
 
         logger.important(f"Removing role {role} from {target} by {requester} request")
-        await target.remove_role(role, reason=reason)
+        roles_edit.remove(role, reason=reason)
 
     # Status: done, not tested
     @classmethod
@@ -1003,85 +1603,193 @@ class RoleSelector(Scale):
         """Removes all roles from this group from the target"""
         removed = []
         logger.important(f"Removing all roles from group {group.display_name} from {target} by {requester} request")
-        async for db_role in BotRole.find(BotRole.group_request(group)):
-            if role := await requester.guild.fetch_role(db_role.role_id):
+        roles_edit = utils.MemberRolesEdit(target)
+        index = await role_index.get(target.guild.id)
+        for db_role in index.get_group_roles(group.id):
+            if role := requester.guild.get_role(db_role.role_id):
                 if role in target.roles:
-                    await cls.try_remove_role(requester, target, role, reason)
+                    await cls.plan_role_remove(roles_edit, requester, role, reason)
                     removed.append(role)
 
+        await roles_edit.apply()
         return removed
 
+    async def sync_role(self, guild: dis_snek.Guild, role_id: int, role: Optional[dis_snek.Role]):
+        """Reconciles a single tracked role with discord: deletes it, if role is None, or updates its internal name"""
+        index = await role_index.get(guild.id)
+        db_role = index.roles.get(role_id)
+        if db_role is None:
+            return  # role is not tracked, nothing to sync
+
+        group = index.groups[db_role.group_id]
+        if role is None:
+            logger.db(f"Deleting role {db_role.name} for guild {guild.name}, role doesn't exist anymore")
+            await BotRole.find_one(BotRole.id == db_role.id).delete()
+            BotRole.invalidate_cache()
+            index.remove_role(role_id)
+        elif role.name != db_role.name:
+            logger.db(f"Renaming role {db_role.name} to {role.name} for guild {guild.name}")
+            await BotRole.find_one(BotRole.id == db_role.id).update(Set({BotRole.name: role.name}))
+            BotRole.invalidate_cache()
+            index.add_role(attr.evolve(db_role, name=role.name))
+        else:
+            return  # e.g. role position or color changed, nothing to update in the database
+
+        await self.on_group_roles_change(group=group, guild=guild)
+
     # status: done, tested
-    async def sync_roles_for_guild(self, guild: dis_snek.Guild):
+    async def sync_roles_for_guild(self, guild: dis_snek.Guild) -> "RolesSyncResult":
         """Deletes all roles from DB, that are not in this guild anymore, updates internal name for renamed roles"""
-        deleted = set()
-        renamed = dict()
-        groups_to_update = set()
-
+        result = RolesSyncResult()
+        timer = utils.PhaseTimer()
         logger.info(f"Syncing roles for guild {guild.name}")
-        async for group in RoleGroup.find(RoleGroup.guild_id == guild.id):
-            # change during iteration
-            db_roles = await BotRole.find(BotRole.group_request(group)).to_list()
-            for db_role in db_roles:
-                role = await guild.fetch_role(db_role.role_id)
-                if not role:
-                    deleted.add(db_role.name)
-                    logger.db(f"Deleting role {db_role.name} for guild {guild.name}, role doesn't exist anymore")
-                    groups_to_update.add(db_role.group.ref.id)
-                    await db_role.delete()
-                elif role.name != db_role.name:
-                    renamed[db_role.name] = role.name
-                    logger.db(f"Renaming role {db_role.name} to {role.name} for guild {guild.name}")
-                    db_role.name = role.name
-                    groups_to_update.add(db_role.group.ref.id)
-                    await db_role.save()
 
+        groups = {group.id: group for group in await RoleGroup.find(RoleGroup.guild_id == guild.id).to_list()}
+        db_roles = await BotRole.find(In("group.$id", list(groups.keys()))).to_list()
+        timer.lap("load")
+
+        # Discord role ID -> role name. Cache might be incomplete (e.g. while guild is unavailable),
+        # so cache misses are confirmed with a single request for all roles of the guild before deleting anything
+        role_names = {db_role.role_id: role.name for db_role in db_roles if (role := guild.get_role(db_role.role_id))}
+        if len(role_names) < len(db_roles):
+            # Sync fails without deleting anything (and is retried on the next run), if roles can't be confirmed
+            try:
+                roles_data = await self.bot.http.get_roles(guild.id)
+            except Exception as e:
+                raise utils.BadBotArgument(f"Unable to fetch roles of the guild {guild.name}, sync skipped") from e
+            if not roles_data:
+                raise utils.BadBotArgument(f"Got no roles for the guild {guild.name}, sync skipped")
+            role_names.update({int(role_data["id"]): role_data["name"] for role_data in roles_data})
+        timer.lap("fetch")
+
+        uow = db.UnitOfWork()
+        deleted_roles = []  # (role, write result)
+        renamed_roles = []  # (role, old name, write result)
+        for db_role in db_roles:
+            role_name = role_names.get(db_role.role_id)
+            if role_name is None:
+                logger.db(f"Deleting role {db_role.name} for guild {guild.name}, role doesn't exist anymore")
+                deleted_roles.append((db_role, uow.delete(db_role)))
+            elif role_name != db_role.name:
+                logger.db(f"Renaming role {db_role.name} to {role_name} for guild {guild.name}")
+                old_name, db_role.name = db_role.name, role_name
+                renamed_roles.append((db_role, old_name, uow.update(db_role)))
+        timer.lap("diff")
+
+        await uow.flush()
+        timer.lap("write")
+
+        # Index is updated only for successful writes, so it stays in sync with the database
+        index = await role_index.get(guild.id)
+        groups_to_update = set()
+        for db_role, write in deleted_roles:
+            if not write.ok:
+                logger.warning(f"Failed to delete role {db_role.name} for guild {guild.name}: {write.error}")
+                continue
+            result.deleted.add(db_role.name)
+            index.remove_role(db_role.role_id)
+            groups_to_update.add(link_id(db_role.group))
+        for db_role, old_name, write in renamed_roles:
+            if not write.ok:
+                logger.warning(f"Failed to rename role {old_name} for guild {guild.name}: {write.error}")
+                continue
+            result.renamed[old_name] = db_role.name
+            index.add_role(RoleRecord.from_document(db_role))
+            groups_to_update.add(link_id(db_role.group))
         for group_id in groups_to_update:
-            group = await RoleGroup.find_one(RoleGroup.id == group_id)
-            await self.on_group_roles_change(group=group, guild=guild)
+            await self.on_group_roles_change(group=groups[group_id], guild=guild)
+        timer.lap("refresh")
 
-        logger.info(f"Performed roles sync, {len(deleted)} deleted, {len(renamed)} renamed")
-        return deleted, renamed
+        result.timings = timer.timings
+        logger.info(
+            f"Performed roles sync, {len(result.deleted)} deleted, {len(result.renamed)} renamed "
+            f"in {timer.format()}"
+        )
+        return result
 
     # status: done, tested
-    @staticmethod
+    @classmethod
     async def check_role_for_tracking(
+        cls,
         role: dis_snek.Role,
     ) -> Tuple[bool, Optional[str]]:
         if not role:
             return False, f"Invalid role {role}"
 
-        if role.bot_managed or role.premium_subscriber or role.integration or role.default:
-            logger.info(f"Skipping role '{role}' as it's system role")
-            return False, f"Role {role.mention} is a system role and won't be managed"
+        return (await cls.check_roles_for_tracking([role]))[role.id]
 
-        if not await can_manage_role(role.guild.me, role):
-            logger.info(f"Skipping role '{role}' as bot cannot manage it")
-            return False, f"Bot cannot manage role {role.mention}"
-
-        if await BotRole.find_one(BotRole.role_id == role.id):
-            logger.info(f"Skipping role '{role}' as it already exists")
-            return False, f"Role {role.mention} already managed by bot"
+    @staticmethod
+    async def check_roles_for_tracking(
+        roles: list[dis_snek.Role],
+    ) -> dict[int, Tuple[bool, Optional[str]]]:
+        """Bulk version of check_role_for_tracking, checks all roles of one guild with a single DB query"""
+        if not roles:
+            return {}
+
+        can_manage = await can_manage_roles(roles[0].guild.me, roles)
+        tracked_roles = await BotRole.find(In(BotRole.role_id, [role.id for role in roles])).to_list()
+        tracked_ids = {db_role.role_id for db_role in tracked_roles}
+
+        results = {}
+        for role in roles:
+            if role.bot_managed or role.premium_subscriber or role.integration or role.default:
+                logger.info(f"Skipping role '{role}' as it's system role")
+                results[role.id] = False, f"Role {role.mention} is a system role and won't be managed"
+            elif not can_manage[role.id]:
+                logger.info(f"Skipping role '{role}' as bot cannot manage it")
+                results[role.id] = False, f"Bot cannot manage role {role.mention}"
+            elif role.id in tracked_ids:
+                logger.info(f"Skipping role '{role}' as it already exists")
+                results[role.id] = False, f"Role {role.mention} already managed by bot"
+            else:
+                results[role.id] = True, None
 
-        return True, None
+        return results
 
     # status: done, not tested
     async def on_group_roles_change(self, group: RoleGroup, guild: Guild):
-        async for selector in RoleSelectorMessage.find(RoleSelectorMessage.group_request(group)):
-            selector: RoleSelectorMessage
+        """Schedules re-rendering of all selectors of the group"""
+        self.render_queue.schedule(group.id, guild)
+
+    async def render_group_selectors(self, group_id: PydanticObjectId, guild: Guild):
+        index = await role_index.get(guild.id)
+        group = index.groups.get(group_id)
+        selectors = index.get_group_selectors(group_id)
+        if group is None or not selectors:
+            return
+
+        try:
+            send_params = await self.create_selector_send_params(group=group, guild=guild)
+        except utils.BadBotArgument as e:
+            logger.warning(f"Unable to render selectors for group {group.display_name} in {guild.name}: {e}")
+            return
+
+        state_hash = self.render_cache.get_hash(group_id)
+        for selector in selectors:
+            if self.render_cache.is_rendered(selector.message_id, state_hash):
+                self.render_cache.skipped_edits += 1
+                continue
+
             try:
                 message = await self.bot.cache.fetch_message(selector.channel_id, selector.message_id)
                 logger.important(
                     f"Updating selector message in {message.channel}.{message.guild} on group {group.display_name} update"
                 )
-                send_params = await self.create_selector_send_params(group=group, guild=guild)
                 await message.edit(**send_params)
+                self.render_cache.mark_rendered(selector.message_id, state_hash)
             except dis_snek.errors.SnakeException as e:
                 logger.warning(f"Exception during selector update:", exc_info=e)
                 continue
 
     # status: done, not tested
     async def create_selector_send_params(self, group: RoleGroup, guild: Guild) -> dict:
+        """Renders selector message for the group. Payload is cached until state of the group changes"""
+        index = await role_index.get(guild.id)
+        db_roles: List[RoleRecord] = index.get_group_roles(group.id, only_assignable=True)
+        state_hash = self.get_selector_state_hash(group, db_roles, guild)
+        if (send_params := self.render_cache.get(group.id, state_hash)) is not None:
+            return send_params
+
         # Creating embed with roles list
         embed_title = "Select one role from the list below!" if group.exclusive_roles else "Select roles from the list below!"
         embed_fields = await self.get_roles_list_fields(group=group, guild=guild, only_assignable=True)
@@ -1089,11 +1797,10 @@ class RoleSelector(Scale):
         embed = dis_snek.Embed(title=embed_title, color=embed_color, fields=embed_fields)
 
         # Creating selector and buttons components
-        db_roles: List[BotRole] = await BotRole.find(BotRole.group_request(group), BotRole.assignable == True).to_list()
         options = [
             SelectOption(
                 label=role.name,
-                value=str(role.id),
+                value=str(role.role_id),
                 description=role.description,
                 emoji=role.emoji,
             )
@@ -1112,24 +1819,42 @@ class RoleSelector(Scale):
             options=options,
             min_values=0,
             max_values=1 if group.exclusive_roles else len(options),
-            custom_id="static_role_select",
+            custom_id=encode_selector_id(SELECTOR_SELECT_ID, group.id, state_hash),
         )
         clear_roles_button = Button(
             style=dis_snek.ButtonStyles.PRIMARY,
             label="Remove role" if group.exclusive_roles else "Remove roles",
-            custom_id="static_role_clear_roles",
+            custom_id=encode_selector_id(SELECTOR_CLEAR_ID, group.id, state_hash),
         )
 
         components = [[select], [clear_roles_button]]
 
-        return {
+        send_params = {
             "embed": embed,
             "components": components,
         }
+        self.render_cache.put(group.id, state_hash, send_params)
+        return send_params
+
+    @staticmethod
+    def get_selector_state_hash(group: RoleGroup, db_roles: list[RoleRecord], guild: Guild) -> str:
+        """Hash of everything that affects the rendered selector of the group"""
+        state = (
+            group.name,
+            str(group.color),
+            group.exclusive_roles,
+            [
+                (str(db_role.id), db_role.role_id, db_role.name, db_role.description, db_role.emoji)
+                for db_role in db_roles
+                if guild.get_role(db_role.role_id) is not None
+            ],
+        )
+        return hashlib.sha1(repr(state).encode()).hexdigest()[:16]
 
     # status: done, not tested
     async def mark_selectors_deleted(self, group):
         group_selectors = await RoleSelectorMessage.find(RoleSelectorMessage.group_request(group)).to_list()
+        uow = db.UnitOfWork()
         for selector in group_selectors:
             selector: RoleSelectorMessage
             message = await self.bot.cache.fetch_message(selector.channel_id, selector.message_id)
@@ -1143,18 +1868,17 @@ class RoleSelector(Scale):
                     color=utils.ResponseStatusColors.ERROR.value,
                 )
             )
-            await selector.delete()
+            uow.delete(selector)
+        await uow.flush()
 
     async def get_roles_list_fields(self, group: RoleGroup, guild: Guild, only_assignable: bool = True) -> list[EmbedField]:
         fields = []
-        db_roles = BotRole.find(BotRole.group_request(group))
-        if only_assignable:
-            db_roles.find(BotRole.assignable == True)
-        db_role: BotRole
+        index = await role_index.get(guild.id)
+        db_role: RoleRecord
 
         mentions = []
-        async for db_role in db_roles:
-            if role := await guild.fetch_role(db_role.role_id):
+        for db_role in index.get_group_roles(group.id, only_assignable=only_assignable):
+            if role := guild.get_role(db_role.role_id):
                 emoji = db_role.emoji or self.bot.get_emoji(utils.SystemEmojis.BLANK)
                 mentions.append(f"{emoji}{role.mention}")
 
@@ -1175,3 +1899,62 @@ def setup(bot):
     bot.add_model(RoleGroup)
     bot.add_model(BotRole)
     bot.add_model(RoleSelectorMessage)
+
+
+if __name__ == "__main__":
+    # Measures CPU and allocations of reading roles of one group for a render, without a database:
+    # full BotRole documents (pydantic validation, as render paths did before) vs slim records of projected documents
+    import timeit
+    import tracemalloc
+    from types import SimpleNamespace
+
+    from bson import DBRef
+    from pydantic import validate_model
+
+    roles_count = 150
+    repeats = 50
+
+    group = RoleGroup.construct(id=ObjectId(), guild_id=1, name="benchmark", priority=0, exclusive_roles=False)
+    guild = SimpleNamespace(get_role=lambda role_id: role_id)
+    raw_roles = [
+        {
+            "_id": ObjectId(),
+            "role_id": 10**17 + i,
+            "name": f"Role {i}",
+            "group": DBRef("RoleGroup", group.id),
+            "assignable": True,
+            "description": f"Description of role {i}",
+            "emoji": None,
+        }
+        for i in range(roles_count)
+    ]
+
+    def load_documents() -> list:
+        # Same validation as BotRole(**raw), which can't be created without an initialized collection
+        documents = []
+        for raw in raw_roles:
+            values, fields_set, _ = validate_model(BotRole, raw)
+            documents.append(BotRole.construct(_fields_set=fields_set, **values))
+        return documents
+
+    def load_records() -> list:
+        return [RoleRecord.from_raw(raw) for raw in raw_roles]
+
+    print(f"Render of a group with {roles_count} roles:")
+    for name, load in {"documents": load_documents, "records": load_records}.items():
+        render_time = timeit.timeit(
+            lambda: RoleSelector.get_selector_state_hash(group, load(), guild), number=repeats
+        )
+
+        tracemalloc.start()
+        roles = load()
+        RoleSelector.get_selector_state_hash(group, roles, guild)
+        retained, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        del roles
+
+        print(
+            "  {:10} {:6.2f} ms per render, {:6.1f} KiB allocated, {:6.1f} KiB retained".format(
+                name, render_time / repeats * 1000, peak / 1024, retained / 1024
+            )
+        )
@@ -1,3 +1,4 @@
+import asyncio
 from collections import defaultdict
 from datetime import datetime
 from typing import Optional
@@ -7,17 +8,34 @@ import dis_snek
 import pytz
 from dateutil import tz
 from dis_snek import AutocompleteContext, InteractionContext, Scale, slash_int_option, slash_str_option, subcommand
+from beanie import Indexed
 from pydantic import BaseModel, Field
 
+import utils.db as db
+from utils.autocomplete import cached_autocomplete
 from utils.db import Document
-from utils.fuzz import fuzzy_autocomplete, fuzzy_find
+from utils.fuzz import FuzzyIndex
 
 
 class UserTimezone(Document):
-    user_id: int
+    user_id: Indexed(int)
     timezone: str
 
 
+db.register_query_shape(UserTimezone, "by user", {"user_id": 0})
+
+
+def timezone_prefix_choices(ctx: AutocompleteContext, timezone: str) -> list[str]:
+    """Degraded timezone autocomplete: timezones, name or any part of the name of which starts with the query"""
+    query = timezone.casefold()
+    names = [
+        name
+        for name in pytz.common_timezones
+        if name.casefold().startswith(query) or any(part.startswith(query) for part in name.casefold().split("/"))
+    ]
+    return [Timezones.format_timezone(name) for name in names[:25]]
+
+
 class Timezones(Scale):
     def __init__(self, client):
         self.timezones = []
@@ -37,6 +55,12 @@ class Timezones(Scale):
         print(self.abbreviations)
         print(self.offsets)
 
+        # Corpora are static, so they are processed for fuzzy matching once
+        self.names_index = FuzzyIndex(pytz.common_timezones)
+        self.abbreviations_index = FuzzyIndex(list(self.abbreviations.keys()))
+        # Offsets are matched as is, as default processing drops their signs
+        self.offsets_index = FuzzyIndex(list(self.offsets.keys()), processor=None)
+
     @subcommand(base="timezone", name="set")
     async def timezone_set(
         self,
@@ -50,20 +74,22 @@ class Timezones(Scale):
         pass
 
     @timezone_set.autocomplete("timezone")
+    @cached_autocomplete(fallback=timezone_prefix_choices, per_guild=False)
     async def _timezone_set_tz(self, ctx: AutocompleteContext, timezone, **kwargs):
-        results = []
         # abbreviations = fuzzy_autocomplete(timezone, list(self.abbreviations.keys()))
         # for abbreviation, score, _ in abbreviations:
         #     entries = [(name, score) for name in self.abbreviations[abbreviation]]
         #     results.extend(entries)
 
-        # Search by abbreviations and append all timezones with matching abbreviations to the results
-        results.extend(self.expand_results(timezone, self.abbreviations))
-
-        # Search by offsets and append all timezones with matching offsets to the results
-        results.extend(self.expand_results(timezone, self.offsets, additional_score=30))
-
-        results.extend(fuzzy_autocomplete(timezone, pytz.common_timezones))
+        # Searches run concurrently in the fuzzy executor
+        by_abbreviation, by_offset, by_name = await asyncio.gather(
+            # Search by abbreviations and append all timezones with matching abbreviations to the results
+            self.expand_results(timezone, self.abbreviations_index, self.abbreviations),
+            # Search by offsets and append all timezones with matching offsets to the results
+            self.expand_results(timezone, self.offsets_index, self.offsets, additional_score=30),
+            self.names_index.autocomplete_async(timezone),
+        )
+        results = by_abbreviation + by_offset + list(by_name)
 
         # Sort by score, the highest score LAST
         results.sort(key=lambda item: item[1])
@@ -80,9 +106,11 @@ class Timezones(Scale):
         await ctx.send(results)
 
     @staticmethod
-    def expand_results(query: str, data_dict: dict[str, list[str]], additional_score: int = 0) -> list[tuple[str, int]]:
+    async def expand_results(
+        query: str, index: FuzzyIndex, data_dict: dict[str, list[str]], additional_score: int = 0
+    ) -> list[tuple[str, int]]:
         results = []
-        fuzzy_results = fuzzy_autocomplete(query, list(data_dict.keys()))
+        fuzzy_results = await index.autocomplete_async(query)
         for abbreviation, score, _ in fuzzy_results:
             entries = [(name, score + additional_score) for name in data_dict[abbreviation]]
             results.extend(entries)
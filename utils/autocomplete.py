@@ -0,0 +1,174 @@
+import asyncio
+import functools
+import logging
+from typing import Any, Awaitable, Callable, Coroutine, Hashable, Optional
+
+from dis_snek import AutocompleteContext
+
+import utils.log as log_utils
+from utils.cache import NOT_FOUND, TTLCache
+
+logger: log_utils.BotLogger = logging.getLogger(__name__)  # type: ignore
+
+# Discord sends autocomplete request on almost every keystroke, results for the same query are reused for a short time
+AUTOCOMPLETE_TTL = 10  # seconds
+AUTOCOMPLETE_CAPACITY = 2000
+
+# Discord drops autocomplete responses after 3 seconds, so handlers that take longer get a degraded response
+AUTOCOMPLETE_BUDGET = 2  # seconds
+
+_cache = TTLCache(AUTOCOMPLETE_CAPACITY, AUTOCOMPLETE_TTL)
+_latest_choices = TTLCache(AUTOCOMPLETE_CAPACITY)  # (handler, guild) -> latest choices, last resort when degrading
+_stats = {"degraded": 0, "late results cached": 0}
+_in_flight: dict[Hashable, tuple[asyncio.Task, "CapturingContext"]] = {}  # slow handlers are not started twice
+
+
+class CapturingContext:
+    """Proxy of the autocomplete context, that captures sent choices instead of sending them"""
+
+    def __init__(self, ctx: AutocompleteContext):
+        self._ctx = ctx
+        self.choices: Optional[list] = None
+        self.degraded = False  # interaction didn't wait for the handler
+
+    def __getattr__(self, item: str) -> Any:
+        return getattr(self._ctx, item)
+
+    async def send(self, choices: list):
+        self.choices = list(choices)
+
+
+def get_choice_name(choice: Any) -> str:
+    return choice["name"] if isinstance(choice, dict) else str(choice)
+
+
+def filter_choices(choices: list, query: str) -> list:
+    query = query.casefold()
+    return [choice for choice in choices if query in get_choice_name(choice).casefold()]
+
+
+def get_shorter_query_choices(scope: Hashable, query: str) -> Optional[list]:
+    """Choices of the longest cached query, that this query extends, filtered by the query. None if nothing is cached"""
+    for length in range(len(query) - 1, -1, -1):
+        choices = _cache.get((scope, query[:length]))
+        if choices is not NOT_FOUND:
+            return filter_choices(choices, query)
+    return None
+
+
+def get_degraded_choices(
+    ctx: AutocompleteContext,
+    handler_name: str,
+    guild_id: Optional[int],
+    scope: Optional[Hashable],
+    fallback: Optional[Callable[[AutocompleteContext, str], list]],
+) -> list:
+    """
+    Choices for the handler, that didn't respond in time: choices of the cached shorter query, choices of the fallback
+    or, as the last resort, the latest choices of the handler in the guild (scope is None, if version isn't known yet)
+    """
+    if scope is not None and (choices := get_shorter_query_choices(scope, ctx.input_text)) is not None:
+        return choices
+    if fallback is not None and (choices := fallback(ctx, ctx.input_text)):
+        return choices
+    latest = _latest_choices.get((handler_name, guild_id))
+    if latest is NOT_FOUND:
+        return []
+    return filter_choices(latest, ctx.input_text) or list(latest)
+
+
+def cache_choices(key: Hashable, choices: list):
+    _cache.put(key, choices)
+    (handler_name, guild_id, _), _ = key
+    _latest_choices.put((handler_name, guild_id), choices)
+
+
+def cached_autocomplete(
+    func: Optional[Callable] = None,
+    *,
+    version: Optional[Callable[[AutocompleteContext], Awaitable[Hashable]]] = None,
+    fallback: Optional[Callable[[AutocompleteContext, str], list]] = None,
+    per_guild: bool = True,
+):
+    """
+    Caches choices of the autocomplete handler by (handler, guild, version, query).
+    Version (e.g. of the guild's role groups) is optional, choices cached for other versions are never reused.
+    Handlers, choices of which don't depend on the guild, should pass per_guild=False to share cache between guilds.
+    If the version and the handler don't resolve within AUTOCOMPLETE_BUDGET, responds with choices of the cached
+    shorter query, of the cheap fallback(ctx, query) (e.g. prefix matches) or with the latest choices of the handler;
+    choices of the handler are cached when it finishes.
+    Decorator must be applied before (below) the @<command>.autocomplete decorator
+    """
+    if func is None:
+        return functools.partial(cached_autocomplete, version=version, fallback=fallback, per_guild=per_guild)
+
+    @functools.wraps(func)
+    async def wrapper(self, ctx: AutocompleteContext, *args, **kwargs):
+        guild_id = ctx.guild_id if per_guild else None
+        scope = None
+        capturing_ctx = None
+
+        async def get_choices() -> Optional[list]:
+            nonlocal scope, capturing_ctx
+            # Version might need a slow load (e.g. of a cold role index), so it's resolved within the budget too.
+            # It's shielded, so the load isn't aborted by the deadline
+            version_value = await asyncio.shield(version(ctx)) if version is not None else None
+            scope = (func.__qualname__, guild_id, version_value)
+            key = (scope, ctx.input_text)
+            choices = _cache.get(key)
+            if choices is not NOT_FOUND:
+                return choices
+
+            in_flight = _in_flight.get(key)
+            if in_flight is None:
+                new_ctx = CapturingContext(ctx)
+                coro = func(self, new_ctx, *args, **kwargs)
+                task = asyncio.create_task(_run_profiled(ctx, f"autocomplete {func.__qualname__}", coro))
+                in_flight = _in_flight[key] = (task, new_ctx)
+                task.add_done_callback(functools.partial(_finish_handler, key, new_ctx))
+            task, capturing_ctx = in_flight
+
+            await asyncio.shield(task)
+            return capturing_ctx.choices
+
+        try:
+            choices = await asyncio.wait_for(get_choices(), AUTOCOMPLETE_BUDGET)
+        except asyncio.TimeoutError:
+            _stats["degraded"] += 1
+            logger.warning(f"Autocomplete {func.__qualname__} for '{ctx.input_text}' is too slow, degrading")
+            if capturing_ctx is not None:
+                capturing_ctx.degraded = True
+            choices = get_degraded_choices(ctx, func.__qualname__, guild_id, scope, fallback)
+        else:
+            if choices is None:
+                return  # handler didn't respond, nothing to send
+
+        await ctx.send(choices)
+
+    return wrapper
+
+
+async def _run_profiled(ctx: AutocompleteContext, name: str, coro: Coroutine):
+    # Profile is entered inside the task, so queries of the handler, that finishes after the deadline, are counted too
+    with ctx.bot.query_monitor.profile(name):
+        return await coro
+
+
+def _finish_handler(key: Hashable, capturing_ctx: CapturingContext, task: asyncio.Task):
+    _in_flight.pop(key, None)
+    if task.cancelled():
+        return
+    if error := task.exception():
+        if capturing_ctx.degraded:  # otherwise, error is raised in the waiting interaction
+            logger.error(f"Exception in autocomplete {key[0][0]}: {error}", exc_info=error)
+    elif capturing_ctx.choices is not None:
+        if capturing_ctx.degraded:
+            _stats["late results cached"] += 1
+        cache_choices(key, capturing_ctx.choices)
+
+
+def get_stats() -> dict[str, dict[str, int]]:
+    return {
+        "Autocomplete cache": _cache.get_stats(),
+        "Autocomplete deadlines": dict(_stats),
+    }
@@ -1,20 +1,55 @@
+import asyncio
+import contextlib
 import logging
-import datetime
 
-from typing import Any
+from contextvars import ContextVar
+from typing import Any, Optional, TypeVar
+
+import attr
 
 import utils.misc as utils
 import utils.log as log_utils
 
 from pydantic import Field, NonNegativeInt, validator, ValidationError
-from beanie import Document as BeanieDocument
-from beanie.odm.queries.find import FindMany
+from beanie import Document as BeanieDocument, Link, PydanticObjectId
+from beanie.operators import In, Set
+from beanie.odm.utils.encoder import Encoder
+from pymongo import DeleteOne, InsertOne, ReplaceOne, UpdateOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError
 
+from utils.cache import NOT_FOUND, TTLCache
 from utils.misc import is_hex, BadBotArgument
 
 logger: log_utils.BotLogger = logging.getLogger(__name__)  # type: ignore
 
 
+# Cache
+
+_cache_config: dict[str, dict] = {"default": {"capacity": 1000, "ttl": 60}}
+_model_caches: dict[str, TTLCache] = {}
+
+
+def configure_caches(config: Optional[dict]):
+    """
+    Sets capacity and TTL (in seconds) of model caches. Config is a dict of model name -> settings,
+    "default" settings are used for models without their own settings
+    """
+    if config:
+        _cache_config.update({name: dict(settings) for name, settings in config.items()})
+    _model_caches.clear()
+
+
+def get_model_cache(model_name: str) -> TTLCache:
+    if model_name not in _model_caches:
+        settings = _cache_config.get(model_name, _cache_config["default"])
+        _model_caches[model_name] = TTLCache(capacity=settings["capacity"], ttl=settings["ttl"])
+    return _model_caches[model_name]
+
+
+def get_cache_stats() -> dict[str, dict[str, int]]:
+    return {f"{name} cache": cache.get_stats() for name, cache in _model_caches.items()}
+
+
 # Base models
 
 class Document(BeanieDocument):
@@ -25,43 +60,475 @@ class Document(BeanieDocument):
         validate_on_save = True
         use_state_management = True
 
-        # Cache config
-        use_cache = True
-        cache_expiration_time = datetime.timedelta(seconds=10)
-        cache_capacity = 20
+        # Beanie cache is never invalidated on writes, per-model cache with invalidation is used instead
+        use_cache = False
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        # Models declare their own Settings (e.g. for indexes), base settings are copied there explicitly,
+        # as beanie doesn't look for inherited Settings attributes
+        for key, value in vars(Document.Settings).items():
+            if not key.startswith("__") and key not in vars(cls.Settings):
+                setattr(cls.Settings, key, value)
+
+    # Cache
+
+    @classmethod
+    def get_cache(cls) -> TTLCache:
+        return get_model_cache(cls.__name__)
+
+    @classmethod
+    def invalidate_cache(cls):
+        """Must be called after bulk writes, that bypass document methods"""
+        cls.get_cache().invalidate()
+
+    @classmethod
+    async def find_one_cached(cls, *args, **kwargs):
+        """Cached version of find_one, cache of the model is invalidated on every write to the model"""
+        query = cls.find_one(*args, **kwargs)
+        key = repr(query.get_filter_query())
+        cache = cls.get_cache()
+
+        result = cache.get(key)
+        if result is NOT_FOUND:
+            result = await query
+            cache.put(key, result)
+        return result
+
+    # Migrations
+
+    @classmethod
+    async def migrate(cls, database):
+        """
+        Fixes stored data, that doesn't satisfy the model anymore (e.g. its new unique indexes).
+        Called before beanie initialization, so only raw motor collections of the database may be used
+        """
+
+    # Lightweight reads
+
+    @classmethod
+    async def find_projected(cls, query: dict, fields: list[str]) -> list[dict]:
+        """
+        Raw documents with only selected fields (and _id), skipping model validation.
+        For read-only paths over trusted DB data
+        """
+        cursor = cls.get_motor_collection().find(query, projection=dict.fromkeys(fields, True))
+        return await cursor.to_list(length=None)
+
+    # Writes with cache invalidation and error translation
+
+    def duplicate_key_error(self, error: DuplicateKeyError) -> Exception:
+        """Exception to raise when write violates unique index. Override to give user-friendly message"""
+        return error
+
+    @contextlib.contextmanager
+    def _translate_errors(self):
+        try:
+            yield
+        except DuplicateKeyError as e:
+            translated = self.duplicate_key_error(e)
+            if translated is e:
+                raise
+            raise translated from e
+
+    async def insert(self, *args, **kwargs):
+        with self._translate_errors():
+            result = await super().insert(*args, **kwargs)
+        self.invalidate_cache()
+        return result
+
+    async def save(self, *args, **kwargs):
+        with self._translate_errors():
+            result = await super().save(*args, **kwargs)
+        self.invalidate_cache()
+        return result
+
+    async def save_changes(self, *args, **kwargs):
+        with self._translate_errors():
+            result = await super().save_changes(*args, **kwargs)
+        self.invalidate_cache()
+        return result
+
+    async def replace(self, *args, **kwargs):
+        with self._translate_errors():
+            result = await super().replace(*args, **kwargs)
+        self.invalidate_cache()
+        return result
+
+    async def delete(self, *args, **kwargs):
+        with self._translate_errors():
+            result = await super().delete(*args, **kwargs)
+        self.invalidate_cache()
+        return result
+
+    @classmethod
+    async def insert_many(cls, *args, **kwargs):
+        result = await super().insert_many(*args, **kwargs)
+        cls.invalidate_cache()
+        return result
 
 
 class Ordered:
     priority: NonNegativeInt
 
 
-# Generic model operations
-async def generic_edit(obj: Document, fields: dict[str, Any]) -> dict[str, tuple[Any, Any]]:
-    before = obj.dict()
+# Batched loading
 
-    for key, value in fields.items():
-        setattr(obj, key, value)
+DocumentT = TypeVar("DocumentT", bound=Document)
+
+_current_loader: ContextVar[Optional["BatchLoader"]] = ContextVar("batch_loader", default=None)
+
+
+class BatchLoader:
+    """
+    Collects lookups by id made within one event loop tick and resolves them with one $in query per model.
+    Loaded documents are kept for the lifetime of the loader, so it should be short-lived (see get_batch_loader).
+    """
+
+    def __init__(self):
+        self._loaded: dict[tuple[type[Document], Any], Optional[Document]] = {}
+        self._pending: dict[type[Document], dict[Any, asyncio.Future]] = {}
+
+        # Counters
+        self.requested = 0
+        self.queries = 0
 
-    if not obj.is_changed:
-        return {}
+    async def load(self, model: type[DocumentT], doc_id: Any) -> Optional[DocumentT]:
+        self.requested += 1
+        if (model, doc_id) in self._loaded:
+            return self._loaded[(model, doc_id)]  # type: ignore
 
-    logger.db(f"Updating {obj}")
-    # Without this validator for links is failing...
-    # There might be a better workaround for that?
-    await obj.save_changes()
+        pending = self._pending.setdefault(model, {})
+        if doc_id not in pending:
+            loop = asyncio.get_running_loop()
+            if not pending:
+                loop.call_soon(self._dispatch, model)
+            pending[doc_id] = loop.create_future()
+        return await pending[doc_id]
 
-    after = obj.dict()
-    diff = {key: (after[key], before[key])
-            for key in set(before.keys()) & set(after.keys())
-            if after[key] != before[key]
-            }
+    async def load_many(self, model: type[DocumentT], doc_ids: list) -> list[Optional[DocumentT]]:
+        return await asyncio.gather(*(self.load(model, doc_id) for doc_id in doc_ids))
 
+    async def fetch_link(self, link: Link[DocumentT]) -> Optional[DocumentT]:
+        return await self.load(link.model_class, link.ref.id)
+
+    async def fetch_links(self, docs: list[Document]):
+        """Batched version of fetch_all_links for the list of documents"""
+
+        async def fetch(doc: Document, field_name: str, link: Link):
+            setattr(doc, field_name, await self.fetch_link(link))
+
+        await asyncio.gather(
+            *(
+                fetch(doc, field_name, value)
+                for doc in docs
+                for field_name in doc.__fields__
+                if isinstance(value := getattr(doc, field_name), Link)
+            )
+        )
+
+    def _dispatch(self, model: type[Document]):
+        pending = self._pending.pop(model, {})
+        if pending:
+            asyncio.create_task(self._resolve(model, pending))
+
+    async def _resolve(self, model: type[Document], pending: dict[Any, asyncio.Future]):
+        self.queries += 1
+        try:
+            docs = await model.find(In(model.id, list(pending))).to_list()
+        except Exception as e:
+            for future in pending.values():
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        found = {doc.id: doc for doc in docs}
+        for doc_id, future in pending.items():
+            doc = found.get(doc_id)
+            self._loaded[(model, doc_id)] = doc
+            if not future.done():
+                future.set_result(doc)
+
+
+def get_batch_loader() -> BatchLoader:
+    """Returns the loader of the current task (interaction), creating one if needed"""
+    loader = _current_loader.get()
+    if loader is None:
+        loader = BatchLoader()
+        _current_loader.set(loader)
+    return loader
+
+
+# Index audit
+
+_query_shapes: dict[tuple[str, str], tuple[type[Document], dict]] = {}
+
+
+def register_query_shape(model: type[Document], name: str, query: dict):
+    """Registers a hot query shape (with sample values) to be checked by audit_query_shapes"""
+    _query_shapes[(model.__name__, name)] = (model, query)
+
+
+@attr.define()
+class QueryShapeAudit:
+    model_name: str
+    name: str
+    stages: list[str]
+    indexes: list[str]
+
+    @property
+    def is_collection_scan(self) -> bool:
+        return "COLLSCAN" in self.stages
+
+
+def _plan_stages(plan: dict) -> tuple[list[str], list[str]]:
+    """Returns stages and used indexes of the (winning) query plan, from the top stage down"""
+    stages, indexes = [plan.get("stage", "?")], []
+    if "indexName" in plan:
+        indexes.append(plan["indexName"])
+    children = plan.get("inputStages", []) + ([plan["inputStage"]] if "inputStage" in plan else [])
+    for child in children:
+        child_stages, child_indexes = _plan_stages(child)
+        stages.extend(child_stages)
+        indexes.extend(child_indexes)
+    return stages, indexes
+
+
+async def audit_query_shapes() -> list[QueryShapeAudit]:
+    """Runs explain() for every registered query shape"""
+    results = []
+    for (model_name, name), (model, query) in _query_shapes.items():
+        explanation = await model.get_motor_collection().find(query).explain()
+        winning_plan = explanation["queryPlanner"]["winningPlan"]
+        # With the slot based execution engine (MongoDB 5.1+), the plan is nested one level deeper
+        stages, indexes = _plan_stages(winning_plan.get("queryPlan", winning_plan))
+        results.append(QueryShapeAudit(model_name=model_name, name=name, stages=stages, indexes=indexes))
+    return results
+
+
+# Unit of work
+
+@attr.define()
+class WriteResult:
+    """Result of a single document write, awaiting it waits until the write is flushed to the database"""
+
+    document: Document = attr.field()
+    operation: str = attr.field()  # insert, update or delete
+    ok: Optional[bool] = attr.field(default=None, init=False)  # None until flushed
+    error: Optional[Exception] = attr.field(default=None, init=False)
+    _done: asyncio.Future = attr.field(factory=lambda: asyncio.get_running_loop().create_future(), init=False)
+
+    def set_result(self, ok: bool, error: Optional[Exception] = None):
+        self.ok = ok
+        self.error = error
+        if not self._done.done():
+            self._done.set_result(self)
+
+    def __await__(self):
+        return self._done.__await__()
+
+
+class UnitOfWork:
+    """
+    Collects inserts, updates and deletes of documents and flushes them as one bulk_write per collection.
+    Beanie event hooks (before_event/after_event) are NOT run for the collected writes.
+    Can be used as async context manager, collected writes are flushed on exit without exceptions:
+
+        async with UnitOfWork() as uow:
+            for doc in docs:
+                doc.name = "new name"
+                uow.update(doc)
+    """
+
+    def __init__(self, ordered: bool = False):
+        self.ordered = ordered
+        self._pending: dict[type[Document], list[tuple[WriteResult, Any]]] = {}
+
+    async def __aenter__(self) -> "UnitOfWork":
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is None:
+            await self.flush()
+
+    def __len__(self):
+        return sum(len(operations) for operations in self._pending.values())
+
+    def _add(self, document: Document, operation: str, request) -> WriteResult:
+        result = WriteResult(document=document, operation=operation)
+        self._pending.setdefault(type(document), []).append((result, request))
+        return result
+
+    @staticmethod
+    def _encode(document: Document) -> dict:
+        return Encoder(by_alias=True).encode(document)
+
+    def insert(self, document: Document) -> WriteResult:
+        if document.id is None:
+            document.id = PydanticObjectId()
+        return self._add(document, "insert", InsertOne(self._encode(document)))
+
+    def update(self, document: Document) -> WriteResult:
+        """Writes only changed fields when state of the document is tracked, or replaces the whole document"""
+        if document.get_saved_state() is not None:
+            changes = document.get_changes()
+            if not changes:
+                result = WriteResult(document=document, operation="update")
+                result.set_result(ok=True)
+                return result
+            request = UpdateOne({"_id": document.id}, {"$set": changes})
+        else:
+            request = ReplaceOne({"_id": document.id}, self._encode(document))
+        return self._add(document, "update", request)
+
+    def delete(self, document: Document) -> WriteResult:
+        return self._add(document, "delete", DeleteOne({"_id": document.id}))
+
+    async def flush(self) -> list[WriteResult]:
+        """Sends all collected writes to the database. Returns results grouped by collection"""
+        pending, self._pending = self._pending, {}
+        results = []
+        models = list(pending.keys())
+        for position, model in enumerate(models):
+            operations = pending[model]
+            failed: dict[int, Exception] = {}
+            try:
+                await model.get_motor_collection().bulk_write(
+                    [request for _, request in operations],
+                    ordered=self.ordered,
+                )
+            except BulkWriteError as e:
+                failed = {write_error["index"]: e for write_error in e.details.get("writeErrors", [])}
+                if self.ordered and failed:  # ordered bulk write stops on the first error
+                    failed.update({i: e for i in range(min(failed), len(operations))})
+            except Exception as e:
+                # Writes of this and all following collections aren't sent, their results are resolved as failed,
+                # so nothing awaiting them hangs
+                for unsent_model in models[position:]:
+                    for result, _ in pending[unsent_model]:
+                        result.set_result(ok=False, error=e)
+                raise
+            finally:
+                model.invalidate_cache()
+
+            logger.db(f"Flushed {len(operations)} writes to {model.__name__}, {len(failed)} failed")
+            for i, (result, _) in enumerate(operations):
+                result.set_result(ok=i not in failed, error=failed.get(i))
+                if result.ok and result.operation != "delete" and model.get_settings().use_state_management:
+                    result.document._save_state()
+                results.append(result)
+
+        return results
+
+
+# Generic model operations
+def assign_fields(obj: Document, fields: dict[str, Any]) -> dict[str, tuple[Any, Any]]:
+    """Assigns fields, that differ from the current values. Returns diff: field -> (after, before)"""
+    diff = {}
+    for key, value in fields.items():
+        before = getattr(obj, key)
+        if before != value:
+            setattr(obj, key, value)
+            diff[key] = (value, before)
     return diff
 
 
-async def ensure_priority(query: FindMany, priority: int):
-    if await query.find({"priority": priority}).exists():
-        await query.find({"priority": {"$gte": priority}}).inc({"priority": 1})
+def validate_edited(diffs: list[tuple[Document, dict[str, tuple[Any, Any]]]]):
+    """
+    Runs model validation of edited documents, as assignment isn't validated.
+    On failure, changes are reverted and BadBotArgument is raised
+    """
+    try:
+        for obj, _ in diffs:
+            type(obj).parse_obj(obj)
+    except ValidationError as e:
+        for obj, diff in diffs:
+            for key, (_, before) in diff.items():
+                setattr(obj, key, before)
+        errors = "; ".join(f"{'.'.join(map(str, error['loc']))}: {error['msg']}" for error in e.errors())
+        raise BadBotArgument(f"Invalid values: {errors}") from e
+
+
+async def generic_bulk_edit(objs: list[Document], fields: dict[str, Any]) -> list[Document]:
+    """Applies the same change to all documents with a single update_many. Returns list of changed documents"""
+    diffs = [(obj, diff) for obj in objs if (diff := assign_fields(obj, fields))]
+    if not diffs:
+        return []
+    validate_edited(diffs)
+    edited = [obj for obj, _ in diffs]
+
+    model = type(edited[0])
+    # Encoding one document is enough to get DB representation of the values, as they are the same for all documents
+    encoded = Encoder(by_alias=True).encode(edited[0])
+    update = {key: encoded[key] for key in fields}
+
+    logger.db(f"Updating {len(edited)} {model.__name__} documents: {', '.join(update.keys())}")
+    await model.find(In(model.id, [obj.id for obj in edited])).update(Set(update))
+    model.invalidate_cache()
+
+    if model.get_settings().use_state_management:
+        for obj in edited:
+            obj._save_state()
+
+    return edited
+
+
+# Ordering
+# Ordered documents use sparse priority keys, so moving a document changes only its own key.
+# When there is no gap left between neighbours, all documents are rebalanced with a single bulk write.
+
+PRIORITY_GAP = 1024
+
+
+def priority_between(before: Optional[int], after: Optional[int]) -> Optional[int]:
+    """Returns priority key between two neighbours (None means no neighbour) or None, if there is no gap left"""
+    if before is None and after is None:
+        return PRIORITY_GAP
+    if after is None:
+        return before + PRIORITY_GAP
+    low = before if before is not None else -1  # priority is non-negative
+    priority = (low + after) // 2
+    return priority if low < priority < after else None
+
+
+def next_priority(docs: list[Ordered]) -> int:
+    """Priority key to put a new document after all the others"""
+    return priority_between(max((doc.priority for doc in docs), default=None), None)
+
+
+async def move_to_position(doc: Ordered, siblings: list[Ordered], position: int) -> bool:
+    """
+    Sets priority of the document, so it's placed at the position (0-based) among its siblings.
+    Doesn't save the document itself. Returns True if siblings had to be rebalanced
+    """
+    siblings = sorted((sibling for sibling in siblings if sibling.id != doc.id), key=lambda sibling: sibling.priority)
+    position = max(0, min(position, len(siblings)))
+    before = siblings[position - 1].priority if position > 0 else None
+    after = siblings[position].priority if position < len(siblings) else None
+
+    priority = priority_between(before, after)
+    if priority is not None:
+        doc.priority = priority
+        return False
+
+    await reorder(siblings[:position] + [doc] + siblings[position:])
+    return True
+
+
+async def reorder(docs: list[Ordered]):
+    """Assigns evenly spaced priorities to documents in the passed order and writes them with a single bulk write"""
+    requests = []
+    for i, doc in enumerate(docs, 1):
+        if doc.priority != i * PRIORITY_GAP:
+            doc.priority = i * PRIORITY_GAP
+            requests.append(UpdateOne({"_id": doc.id}, {"$set": {"priority": doc.priority}}))
+
+    if not requests:
+        return
+    model = type(docs[0])
+    logger.db(f"Rebalancing priorities of {len(requests)} {model.__name__} documents")
+    await model.get_motor_collection().bulk_write(requests, ordered=False)
+    model.invalidate_cache()
 
 
 # Converters and validators
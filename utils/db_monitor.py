@@ -0,0 +1,164 @@
+import contextlib
+import logging
+import threading
+from collections import Counter
+from contextvars import ContextVar
+from typing import Any, Optional
+
+import attr
+from pymongo import monitoring
+
+import utils.log as log_utils
+
+logger: log_utils.BotLogger = logging.getLogger(__name__)  # type: ignore
+
+_current_profile: ContextVar[Optional["QueryProfile"]] = ContextVar("query_profile", default=None)
+
+
+@attr.define()
+class QueryProfile:
+    """Database usage of a single command (or aggregated usage of all runs of the command)"""
+
+    name: str
+    runs: int = 1
+    queries: int = 0
+    total_time: float = 0  # seconds
+    slowest_time: float = 0
+    slowest_query: Optional[str] = None
+    shapes: Counter = attr.field(factory=Counter)
+    _lock: threading.Lock = attr.field(factory=threading.Lock, repr=False)
+
+    def record(self, shape: str, duration: float):
+        # pymongo publishes events from motor executor threads
+        with self._lock:
+            self.queries += 1
+            self.total_time += duration
+            self.shapes[shape] += 1
+            if duration >= self.slowest_time:
+                self.slowest_time = duration
+                self.slowest_query = shape
+
+    def merge(self, other: "QueryProfile"):
+        with self._lock:
+            self.runs += other.runs
+            self.queries += other.queries
+            self.total_time += other.total_time
+            if other.slowest_time >= self.slowest_time:
+                self.slowest_time = other.slowest_time
+                self.slowest_query = other.slowest_query
+
+    def format(self) -> str:
+        return (
+            f"{self.runs} runs, {self.queries} queries, {self.total_time * 1000:.0f} ms total, "
+            f"slowest {self.slowest_time * 1000:.0f} ms"
+        )
+
+
+def get_value_shape(value: Any) -> Any:
+    """Replaces values of the query with placeholders, keeping field names and operators"""
+    if isinstance(value, dict):
+        return {key: get_value_shape(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [get_value_shape(value[0])] if value else []
+    return "?"
+
+
+def get_command_shape(command_name: str, command: dict) -> str:
+    collection = command.get(command_name)
+    if command_name == "update" and command.get("updates"):
+        query = command["updates"][0].get("q")
+    elif command_name == "delete" and command.get("deletes"):
+        query = command["deletes"][0].get("q")
+    elif command_name == "aggregate":
+        query = command.get("pipeline")
+    else:
+        query = command.get("filter", command.get("query"))
+
+    shape = f"{command_name} {collection}"
+    if query:
+        shape += f" {get_value_shape(query)}"
+    return shape
+
+
+class QueryMonitor(monitoring.CommandListener):
+    """
+    Listens to commands of the motor client: logs slow queries,
+    collects per-command query statistics and warns about queries repeated in one command (N+1).
+    """
+
+    def __init__(self, slow_threshold: float, repeat_threshold: int):
+        self.slow_threshold = slow_threshold  # seconds
+        self.repeat_threshold = repeat_threshold
+
+        self._pending: dict[tuple[Any, int], tuple[Optional[QueryProfile], str]] = {}
+        self.commands: dict[str, QueryProfile] = {}
+
+        # Counters
+        self.slow_queries = 0
+        self.repeated_queries = 0  # commands, in which N+1 was detected
+
+    @contextlib.contextmanager
+    def profile(self, name: str):
+        """Attributes all queries made inside this context to the command with given name"""
+        profile = QueryProfile(name=name)
+        token = _current_profile.set(profile)
+        try:
+            yield profile
+        finally:
+            _current_profile.reset(token)
+            self._finish(profile)
+
+    def _finish(self, profile: QueryProfile):
+        for shape, count in profile.shapes.items():
+            if count > self.repeat_threshold:
+                self.repeated_queries += 1
+                logger.warning(f"Possible N+1 in {profile.name}: query repeated {count} times: {shape}")
+
+        if profile.name in self.commands:
+            self.commands[profile.name].merge(profile)
+        else:
+            self.commands[profile.name] = QueryProfile(
+                name=profile.name,
+                queries=profile.queries,
+                total_time=profile.total_time,
+                slowest_time=profile.slowest_time,
+                slowest_query=profile.slowest_query,
+            )
+
+        if profile.queries:
+            logger.debug(f"{profile.name}: {profile.queries} queries, {profile.total_time * 1000:.0f} ms")
+
+    def started(self, event: monitoring.CommandStartedEvent):
+        shape = get_command_shape(event.command_name, event.command)
+        self._pending[(event.connection_id, event.request_id)] = (_current_profile.get(), shape)
+
+    def succeeded(self, event: monitoring.CommandSucceededEvent):
+        self._complete(event)
+
+    def failed(self, event: monitoring.CommandFailedEvent):
+        self._complete(event)
+
+    def _complete(self, event):
+        try:
+            profile, shape = self._pending.pop((event.connection_id, event.request_id))
+        except KeyError:
+            return
+
+        duration = event.duration_micros / 1_000_000
+        if profile is not None:
+            profile.record(shape, duration)
+
+        if duration >= self.slow_threshold:
+            self.slow_queries += 1
+            source = profile.name if profile is not None else "background"
+            logger.db(f"Slow query ({duration * 1000:.0f} ms) in {source}: {shape}")
+
+    def get_stats(self, limit: int = 10) -> dict[str, dict[str, Any]]:
+        heaviest = sorted(self.commands.values(), key=lambda profile: profile.total_time, reverse=True)[:limit]
+        return {
+            "Database queries": {
+                "slow queries": self.slow_queries,
+                "N+1 detected": self.repeated_queries,
+            },
+            "Database usage by command": {profile.name: profile.format() for profile in heaviest},
+        }
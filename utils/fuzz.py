@@ -1,7 +1,38 @@
+import asyncio
+import bisect
+import functools
+import logging
+import threading
+import time
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Hashable, Optional, Union
+
 from rapidfuzz import fuzz, process
+from rapidfuzz.utils import default_process
+
+import utils.log as log_utils
+from utils.cache import NOT_FOUND, TTLCache
+
+logger: log_utils.BotLogger = logging.getLogger(__name__)  # type: ignore
+
+# Matching runs in a small dedicated pool (rapidfuzz releases the GIL), so heavy queries don't block the event loop
+MAX_WORKERS = 2
+SLOW_MATCH_TIME = 0.05  # seconds
+
+# Larger corpora are narrowed down by prefix and trigrams before scoring with (expensive) WRatio
+PRUNE_THRESHOLD = 300
+MAX_CANDIDATES = 200
+
+# Good matches of recent queries are added to candidates of the queries, that extend them (as user types)
+NARROWING_TTL = 30  # seconds
+NARROWING_CAPACITY = 256
+NARROWING_CUTOFF = 50
+
+_executor = ThreadPoolExecutor(max_workers=MAX_WORKERS, thread_name_prefix="fuzzy")
+_stats = {"calls": 0, "total time, ms": 0.0, "slowest, ms": 0.0}
 
 
-# TODO maybe this needs to be async as heavy fuzzy matching may freeze up event loop
 def fuzzy_autocomplete(query, choices):
     results = process.extract(query, choices, scorer=fuzz.WRatio, limit=25)
 
@@ -12,3 +43,224 @@ def fuzzy_find(query, choices):
     result = process.extractOne(query, choices, scorer=fuzz.WRatio, score_cutoff=70)
 
     return result[0] if result is not None else None
+
+
+async def run_matching(func: Callable, query: str, *args, **kwargs) -> Any:
+    """Runs matching function in the fuzzy executor, keeps timing stats"""
+    loop = asyncio.get_running_loop()
+    start = time.perf_counter()
+    result = await loop.run_in_executor(_executor, functools.partial(func, query, *args, **kwargs))
+    duration = time.perf_counter() - start
+
+    _stats["calls"] += 1
+    _stats["total time, ms"] += duration * 1000
+    _stats["slowest, ms"] = max(_stats["slowest, ms"], duration * 1000)
+    if duration >= SLOW_MATCH_TIME:
+        logger.debug(f"Slow fuzzy matching ({duration * 1000:.0f} ms) of '{query}' with {func.__name__}")
+    return result
+
+
+async def fuzzy_autocomplete_async(query, choices):
+    return await run_matching(fuzzy_autocomplete, query, choices)
+
+
+def get_trigrams(processed: str) -> set[str]:
+    return {processed[i : i + 3] for i in range(len(processed) - 2)}
+
+
+class FuzzyIndex:
+    """
+    Choices, processed once for repeated matching. Results have the same shape as rapidfuzz's:
+    (choice, score, key), where key is the index in the list or the key of the dict (values of dict are matched).
+    Large corpora are searched in two stages: candidates are selected by prefix and shared trigrams,
+    only candidates are scored with WRatio. Exact prefix hits are returned without scoring, if there are enough of them.
+    Choices and queries are processed with rapidfuzz's default_process (which drops punctuation, e.g. signs of offsets),
+    pass processor=None to match them as is
+    """
+
+    def __init__(
+        self,
+        choices: Union[list[str], dict[Any, str]],
+        processor: Optional[Callable[[str], str]] = default_process,
+    ):
+        if isinstance(choices, dict):
+            self.keys = list(choices.keys())
+            self.choices = list(choices.values())
+        else:
+            self.choices = list(choices)
+            self.keys = list(range(len(self.choices)))
+        self.processor = processor
+        self.processed = [self.process(choice) for choice in self.choices]
+
+        self.is_pruned = len(self.processed) > PRUNE_THRESHOLD
+        self.sorted_processed: list[tuple[str, int]] = []
+        self.trigrams: defaultdict[str, list[int]] = defaultdict(list)
+        if self.is_pruned:
+            self.sorted_processed = sorted((processed, i) for i, processed in enumerate(self.processed))
+            for i, processed in enumerate(self.processed):
+                for trigram in get_trigrams(processed):
+                    self.trigrams[trigram].append(i)
+
+        # processed query -> indexes of best choices, that scored above NARROWING_CUTOFF
+        self.narrowing = TTLCache(NARROWING_CAPACITY, NARROWING_TTL)
+        self._narrowing_lock = threading.Lock()  # matching runs in the executor threads
+
+    def __len__(self):
+        return len(self.choices)
+
+    def process(self, text: str) -> str:
+        return self.processor(text) if self.processor is not None else text
+
+    def prefix_hits(self, processed_query: str, limit: int) -> list[int]:
+        start = bisect.bisect_left(self.sorted_processed, (processed_query, -1))
+        hits = []
+        for processed, i in self.sorted_processed[start:]:
+            if not processed.startswith(processed_query) or len(hits) >= limit:
+                break
+            hits.append(i)
+        return hits
+
+    def prefix_autocomplete(self, query: str, limit: int = 25) -> list[tuple[str, float, Any]]:
+        """Choices, that start with the query, without scoring. Cheap fallback, when there is no time for matching"""
+        processed_query = self.process(query)
+        if self.is_pruned:
+            hits = self.prefix_hits(processed_query, limit)
+        else:
+            hits = [i for i, processed in enumerate(self.processed) if processed.startswith(processed_query)][:limit]
+        return [(self.choices[i], 100, self.keys[i]) for i in hits]
+
+    def candidates(
+        self, processed_query: str, prefix_hits: list[int], limit: int
+    ) -> Union[list[str], dict[int, str]]:
+        """
+        Choices to score: prefix hits, best trigram matches and good matches of the recent query, that this one extends.
+        Falls back to all choices, if there are too few candidates (e.g. query is too short)
+        """
+        if not self.is_pruned:
+            return self.processed
+
+        shared = Counter()
+        for trigram in get_trigrams(processed_query):
+            shared.update(self.trigrams.get(trigram, ()))
+        selected = set(prefix_hits)
+        selected.update(i for i, _ in shared.most_common(MAX_CANDIDATES))
+        if len(selected) < limit:
+            return self.processed
+        selected.update(self.narrowed_candidates(processed_query))
+        return {i: self.processed[i] for i in selected}
+
+    def narrowed_candidates(self, processed_query: str) -> list[int]:
+        """Good matches of the longest recent query, that the query extends"""
+        with self._narrowing_lock:
+            for length in range(len(processed_query) - 1, 2, -1):
+                selected = self.narrowing.get(processed_query[:length])
+                if selected is not NOT_FOUND:
+                    return selected
+        return []
+
+    def remember_candidates(self, processed_query: str, scored: list[tuple[str, float, int]]):
+        """Remembers best matches of the query, scored must be sorted by score"""
+        if len(processed_query) < 3:
+            return  # matches of too short queries are too random to narrow down by them
+        selected = [i for _, score, i in scored[:MAX_CANDIDATES] if score >= NARROWING_CUTOFF]
+        with self._narrowing_lock:
+            self.narrowing.put(processed_query, selected)
+
+    def autocomplete(self, query: str, limit: int = 25) -> list[tuple[str, float, Any]]:
+        processed_query = self.process(query)
+        prefix_hits = self.prefix_hits(processed_query, limit) if self.is_pruned and processed_query else []
+        if len(prefix_hits) >= limit:
+            return [(self.choices[i], 100, self.keys[i]) for i in prefix_hits]
+
+        if not self.is_pruned:
+            results = process.extract(processed_query, self.processed, scorer=fuzz.WRatio, processor=None, limit=limit)
+            return [(self.choices[i], score, self.keys[i]) for _, score, i in results]
+
+        candidates = self.candidates(processed_query, prefix_hits, limit)
+        scored = process.extract(processed_query, candidates, scorer=fuzz.WRatio, processor=None, limit=None)
+        self.remember_candidates(processed_query, scored)
+        return [(self.choices[i], score, self.keys[i]) for _, score, i in scored[:limit]]
+
+    def find(self, query: str, score_cutoff: float = 70):
+        processed_query = self.process(query)
+        prefix_hits = self.prefix_hits(processed_query, MAX_CANDIDATES) if self.is_pruned and processed_query else []
+        candidates = self.candidates(processed_query, prefix_hits, 1)
+        result = process.extractOne(
+            processed_query, candidates, scorer=fuzz.WRatio, processor=None, score_cutoff=score_cutoff
+        )
+        return self.choices[result[2]] if result is not None else None
+
+    async def autocomplete_async(self, query: str, limit: int = 25) -> list[tuple[str, float, Any]]:
+        return await run_matching(self.autocomplete, query, limit=limit)
+
+    async def find_async(self, query: str, score_cutoff: float = 70):
+        return await run_matching(self.find, query, score_cutoff=score_cutoff)
+
+
+_dynamic_indexes: dict[Hashable, tuple[Hashable, FuzzyIndex]] = {}
+
+
+def get_dynamic_index(
+    key: Hashable,
+    version: Hashable,
+    choices_factory: Callable[[], Union[list[str], dict[Any, str]]],
+) -> FuzzyIndex:
+    """
+    Returns index for dynamic choices (e.g. role groups of the guild).
+    Index is rebuilt only if the version of the choices has changed since the last call
+    """
+    cached = _dynamic_indexes.get(key)
+    if cached is None or cached[0] != version:
+        cached = (version, FuzzyIndex(choices_factory()))
+        _dynamic_indexes[key] = cached
+    return cached[1]
+
+
+def get_stats() -> dict[str, dict[str, Any]]:
+    return {"Fuzzy matching": {key: round(value, 1) for key, value in _stats.items()}}
+
+
+if __name__ == "__main__":
+    # Compares two-stage search of FuzzyIndex with the full WRatio scan: latency and quality of the results.
+    # As many choices have equal scores, quality is a share of top-10 positions, where score isn't worse than full scan's
+    import datetime
+
+    import pytz
+
+    from utils.color import color_names
+
+    corpora = {"colors": list(color_names.values()), "timezones": list(pytz.common_timezones)}
+    queries = ["blu", "blue", "dark green", "grey", "amarnth", "new york", "europe/ber", "utc", "pacific", "x"]
+    repeats = 20
+
+    for corpus_name, corpus in corpora.items():
+        index = FuzzyIndex(corpus)
+        print(f"{corpus_name} ({len(corpus)} choices):")
+        for query in queries:
+            start = time.perf_counter()
+            for _ in range(repeats):
+                full = process.extract(query, corpus, scorer=fuzz.WRatio, processor=default_process, limit=25)
+            full_time = (time.perf_counter() - start) / repeats
+
+            start = time.perf_counter()
+            for _ in range(repeats):
+                pruned = index.autocomplete(query)
+            pruned_time = (time.perf_counter() - start) / repeats
+
+            full_scores = [score for _, score, _ in full[:10]]
+            pruned_scores = [score for _, score, _ in pruned[:10]]
+            quality = sum(pruned >= full for full, pruned in zip(full_scores, pruned_scores)) / len(full_scores)
+            print(
+                "  {:12} full: {:6.2f} ms  pruned: {:6.2f} ms  quality: {:4.0%}".format(
+                    query, full_time * 1000, pruned_time * 1000, quality
+                )
+            )
+
+    # Signed UTC offsets must keep their signs, so they are matched without processing
+    offsets = sorted({datetime.datetime.now(pytz.timezone(name)).strftime("%z") for name in pytz.common_timezones})
+    offsets = [f"{offset[:3]}:{offset[3:]}" for offset in offsets]
+    offsets_index = FuzzyIndex(offsets, processor=None)
+    for query in ["-03:00", "+03:00", "-09:30", "+05:45"]:
+        best = offsets_index.autocomplete(query, limit=1)[0][0]
+        assert best == query, f"Offset {query} is matched as {best}"
+    print(f"offsets ({len(offsets)} choices): signs are kept")
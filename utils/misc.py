@@ -1,16 +1,17 @@
 import enum
 import re
+import time
 from collections import abc
 from enum import Enum
 from typing import Optional
 
 import dis_snek
 import emoji
-from dis_snek import AutocompleteContext, Embed
+from dis_snek import MISSING, Absent, AutocompleteContext, Embed
 from dis_snek import FlatUIColors as FlatColors
 
 from utils.color import color_names, colors, find_color_name, hex2rgb, rgb2hex
-from utils.fuzz import fuzzy_autocomplete
+from utils.fuzz import FuzzyIndex
 
 
 class SkyBotException(Exception):
@@ -39,6 +40,107 @@ class aenumerate(abc.AsyncIterator):
         return self._i, val
 
 
+class MemberRolesEdit:
+    """Collects role changes for a member and applies all of them with a single member edit request"""
+
+    max_reason_len = 512  # discord audit log reason limit
+
+    def __init__(self, member: dis_snek.Member):
+        self.member = member
+        self.to_add: dict[int, dis_snek.Role] = {}
+        self.to_remove: dict[int, dis_snek.Role] = {}
+        self.reasons: list[str] = []
+
+    def add(self, role: dis_snek.Role, reason: Absent[str] = MISSING):
+        self.to_remove.pop(role.id, None)
+        self.to_add[role.id] = role
+        self._add_reason(reason)
+
+    def remove(self, role: dis_snek.Role, reason: Absent[str] = MISSING):
+        self.to_add.pop(role.id, None)
+        self.to_remove[role.id] = role
+        self._add_reason(reason)
+
+    def _add_reason(self, reason: Absent[str]):
+        if reason and reason not in self.reasons:
+            self.reasons.append(reason)
+
+    @property
+    def current_role_ids(self) -> list[int]:
+        # Role IDs of the member, including roles missing from the cache, so they aren't removed by the edit
+        return [int(role_id) for role_id in self.member._role_ids]
+
+    @property
+    def changes(self) -> list[tuple[bool, dis_snek.Role]]:
+        """Role changes, that aren't applied to the member yet, as (is_added, role)"""
+        current = set(self.current_role_ids)
+        added = [(True, role) for role_id, role in self.to_add.items() if role_id not in current]
+        removed = [(False, role) for role_id, role in self.to_remove.items() if role_id in current]
+        return added + removed
+
+    @property
+    def role_ids(self) -> list[int]:
+        """Final list of member role IDs after the edit"""
+        current = self.current_role_ids
+        role_ids = [role_id for role_id in current if role_id not in self.to_remove]
+        role_ids.extend(role_id for role_id in self.to_add if role_id not in current)
+        return role_ids
+
+    @property
+    def reason(self) -> Absent[str]:
+        if not self.reasons:
+            return MISSING
+        reason = "; ".join(self.reasons)
+        if len(reason) > self.max_reason_len:
+            reason = reason[: self.max_reason_len - 3] + "..."
+        return reason
+
+    @property
+    def is_changed(self) -> bool:
+        return bool(self.changes)
+
+    async def apply(self) -> bool:
+        """Sends the edit request if there are any changes. Returns True if request was sent"""
+        changes = self.changes
+        if not changes:
+            return False
+
+        if len(changes) == 1:
+            # Single role is added or removed on its own, so concurrent edits of other roles aren't overwritten
+            is_added, role = changes[0]
+            if is_added:
+                await self.member.add_role(role, reason=self.reason)
+            else:
+                await self.member.remove_role(role, reason=self.reason)
+        else:
+            await self.member._client.http.modify_guild_member(
+                self.member._guild_id, self.member.id, roles=self.role_ids, reason=self.reason
+            )
+        return True
+
+
+class PhaseTimer:
+    """Measures durations of consecutive phases of some process"""
+
+    def __init__(self):
+        self.timings: dict[str, float] = {}
+        self._started = self._last = time.perf_counter()
+
+    def lap(self, phase: str) -> float:
+        now = time.perf_counter()
+        self.timings[phase] = now - self._last
+        self._last = now
+        return self.timings[phase]
+
+    @property
+    def total(self) -> float:
+        return self._last - self._started
+
+    def format(self) -> str:
+        phases = ", ".join(f"{phase}: {duration * 1000:.1f}ms" for phase, duration in self.timings.items())
+        return f"{self.total * 1000:.1f}ms ({phases})"
+
+
 class ResponseStatusColors(dis_snek.Color, Enum):
     INFO = FlatColors.BELIZEHOLE.value
     SUCCESS = FlatColors.EMERLAND.value
@@ -53,7 +155,7 @@ def get_default_embed(guild: dis_snek.Guild, title: Optional[str], status: Respo
 
 
 def format_lines(d: dict, delimiter="|"):
-    max_len = max(map(len, d.keys()))
+    max_len = max(map(len, d.keys()), default=0)
     lines = [f"{name:<{max_len}}{delimiter} {value}" for name, value in d.items()]
     return lines
 
@@ -103,6 +205,9 @@ async def send_with_embed(
     return await ctx.send(embeds=embeds, **kwargs)
 
 
+color_names_index = FuzzyIndex(color_names)
+
+
 async def color_autocomplete(ctx: AutocompleteContext, color: str):
     try:
         if not is_hex(color):
@@ -120,7 +225,13 @@ async def color_autocomplete(ctx: AutocompleteContext, color: str):
         results = [dict(name=name, value=value) for name, value in results.items()]
     except ValueError:
         # color is color name
-        results = fuzzy_autocomplete(color, color_names)
+        results = await color_names_index.autocomplete_async(color)
         results = [dict(name=f"{name} | {hex_color}", value=hex_color) for name, _, hex_color in results]
 
     await ctx.send(results)
+
+
+def color_prefix_choices(ctx: AutocompleteContext, color: str) -> list[dict]:
+    """Degraded color autocomplete: color names, that start with the query"""
+    results = color_names_index.prefix_autocomplete(color)
+    return [dict(name=f"{name} | {hex_color}", value=hex_color) for name, _, hex_color in results]
@@ -9,7 +9,7 @@ from pydantic.fields import ModelField
 from beanie import Link
 
 from utils import misc as utils
-from utils.db import Document, generic_edit
+from utils.db import Document, generic_bulk_edit, get_batch_loader
 
 
 @attr.define()
@@ -39,8 +39,7 @@ class ModelEditor:
         return len(self.to_edit) > 1
 
     async def generate_fields(self):
-        for instance in self.to_edit:
-            await instance.fetch_all_links()
+        await get_batch_loader().fetch_links(self.to_edit)
 
         field: ModelField
         for field in self.model.__fields__.values():
@@ -194,10 +193,7 @@ class ModalModelEditor(ModelEditor):
         response_data = await self.process_modal_response(responses)
 
         if self.to_edit:
-            for instance in self.to_edit:
-                diff = await generic_edit(instance, response_data)
-                if diff:
-                    self.edited.append(instance)
+            self.edited.extend(await generic_bulk_edit(self.to_edit, response_data))
         else:
             pass
 
@@ -0,0 +1,109 @@
+import asyncio
+import contextvars
+import logging
+import random
+from typing import Any, Callable, Coroutine, Hashable
+
+import utils.log as log_utils
+
+logger: log_utils.BotLogger = logging.getLogger(__name__)  # type: ignore
+
+
+def create_background_task(coro: Coroutine) -> asyncio.Task:
+    """
+    Creates task with a clean context, so it doesn't inherit state of the interaction that started it
+    (e.g. its query profile or batch loader), as it outlives the interaction
+    """
+    return contextvars.Context().run(asyncio.create_task, coro)
+
+
+class Debouncer:
+    """
+    Coalesces repeated calls for the same key: callback runs once per key,
+    after no new calls for this key were made during the quiet window.
+    Arguments of the latest call are passed to the callback.
+    """
+
+    def __init__(self, callback: Callable[..., Coroutine[Any, Any, Any]], delay: float):
+        self.callback = callback
+        self.delay = delay
+
+        self._deadlines: dict[Hashable, float] = {}
+        self._args: dict[Hashable, tuple] = {}
+        self._tasks: dict[Hashable, asyncio.Task] = {}
+
+        # Counters
+        self.scheduled = 0  # total calls
+        self.merged = 0  # calls, that were merged into already pending ones
+        self.flushed = 0  # callback executions
+
+    @property
+    def pending(self) -> int:
+        return len(self._tasks)
+
+    def schedule(self, key: Hashable, *args):
+        loop = asyncio.get_running_loop()
+        self.scheduled += 1
+        self._deadlines[key] = loop.time() + self.delay
+        self._args[key] = args
+
+        if key in self._tasks:
+            self.merged += 1
+        else:
+            self._tasks[key] = create_background_task(self._wait_and_run(key))
+
+    async def flush(self, key: Hashable):
+        """Runs pending callback for the key right away"""
+        if task := self._tasks.pop(key, None):
+            task.cancel()
+            await self._run(key)
+
+    async def _wait_and_run(self, key: Hashable):
+        loop = asyncio.get_running_loop()
+        # deadline moves forward while new calls keep coming
+        while (delay := self._deadlines[key] - loop.time()) > 0:
+            await asyncio.sleep(delay)
+
+        del self._tasks[key]
+        await self._run(key)
+
+    async def _run(self, key: Hashable):
+        self._deadlines.pop(key, None)
+        args = self._args.pop(key, ())
+        self.flushed += 1
+        try:
+            await self.callback(key, *args)
+        except Exception as e:
+            logger.error(f"Exception in debounced callback {self.callback.__qualname__} for {key}: {e}", exc_info=e)
+
+    def get_stats(self) -> dict[str, int]:
+        return {
+            "scheduled": self.scheduled,
+            "merged": self.merged,
+            "pending": self.pending,
+            "flushed": self.flushed,
+        }
+
+
+async def run_spread(
+    callback: Callable[[Any], Coroutine[Any, Any, Any]],
+    items: list,
+    window: float = 0,
+    concurrency: int = 1,
+    jitter: float = 0.5,
+) -> list:
+    """
+    Runs callback for every item with bounded concurrency.
+    Starts are spread evenly across the window (in seconds), every start is shifted by a random jitter (fraction of the step).
+    Returns list of results or exceptions, in the same order as items.
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+    step = window / len(items) if items else 0
+
+    async def run(position: int, item):
+        delay = (position + random.uniform(-jitter, jitter)) * step
+        await asyncio.sleep(max(delay, 0))
+        async with semaphore:
+            return await callback(item)
+
+    return await asyncio.gather(*(run(position, item) for position, item in enumerate(items)), return_exceptions=True)